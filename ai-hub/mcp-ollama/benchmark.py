@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+"""
+AI-Hub gateway benchmark
+Drives the MCP tools in server.py against a local fake Ollama/AnythingLLM
+backend and reports latency percentiles, throughput and error rate.
+
+Usage:
+    python benchmark.py
+    python benchmark.py --scenarios chat,chat-dup,embed --requests 200 --concurrency 16
+    python benchmark.py --latency 200 --token-rate 40 --failure-rate 0.05 --output results/run.json
+    python benchmark.py --output results/new.json --compare results/run.json
+
+Each Ollama node ("hp", "pi") gets its own fake server so routing, failover
+and admission control are exercised. Results are written as JSON so runs can
+be compared over time.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCENARIOS = ["chat", "chat-dup", "generate", "embed", "health", "compare", "rag"]
+DEFAULT_SCENARIOS = "chat,chat-dup,embed,health"
+EMBED_DIMENSIONS = 64
+
+
+class FakeBackendHandler(BaseHTTPRequestHandler):
+    """Ollama + AnythingLLM stand-in with configurable latency, token rate and failures."""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _chunk(self, payload):
+        data = (json.dumps(payload) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def _inject_failure(self):
+        """Apply base latency, then maybe fail. Returns True if the request was consumed."""
+        config = self.server.config
+        delay = config["latency"] + random.uniform(0, config["jitter"])
+        time.sleep(delay)
+        roll = random.random()
+        if roll < config["drop_rate"]:
+            # Simulate a node dropping the connection mid-request
+            self.close_connection = True
+            self.connection.shutdown(2)
+            return True
+        if roll < config["drop_rate"] + config["failure_rate"]:
+            self._send_json({"error": "injected failure"}, status=500)
+            return True
+        return False
+
+    def do_GET(self):
+        if self._inject_failure():
+            return
+        if self.path == "/api/tags":
+            models = [{"name": m, "size": 4 * 1024**3, "details": {"parameter_size": "8B"}} for m in self.server.models]
+            self._send_json({"models": models})
+        elif self.path == "/api/ps":
+            self._send_json({"models": [{"name": m} for m in self.server.models]})
+        elif self.path == "/api/workspaces":
+            self._send_json({"workspaces": [{"name": "Benchmark", "slug": "cystic-fibrosis"}]})
+        elif self.path.startswith("/api/v1/workspace/"):
+            documents = [{"docpath": f"custom-documents/doc-{i}.json"} for i in range(self.server.config["documents"])]
+            self._send_json({"workspace": [{"slug": self.path.rsplit("/", 1)[-1], "documents": documents}]})
+        elif self.path.startswith("/api/v1/document/"):
+            name = self.path.rsplit("/", 1)[-1]
+            text = "\n\n".join(f"{name} paragraph {i} about topic {i % 7}" for i in range(20))
+            self._send_json({"document": {"title": name, "pageContent": text}})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if self._inject_failure():
+            return
+        if self.path in ("/api/chat", "/api/generate"):
+            self._generate(request)
+        elif self.path == "/api/embed":
+            inputs = request.get("input", [])
+            inputs = [inputs] if isinstance(inputs, str) else inputs
+            self._send_json({"model": request.get("model"), "embeddings": [fake_embedding(t) for t in inputs]})
+        elif self.path.startswith("/api/v1/workspace/"):
+            time.sleep(self.server.config["tokens"] / self.server.config["token_rate"])
+            self._send_json({"textResponse": "benchmark answer", "sources": [{"title": "doc-0", "text": "source"}]})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    def _generate(self, request):
+        config = self.server.config
+        model = request.get("model", "")
+        tokens = config["tokens"]
+        interval = 1.0 / config["token_rate"]
+        is_chat = self.path == "/api/chat"
+        final = {
+            "model": model,
+            "done": True,
+            "prompt_eval_count": 32,
+            "eval_count": tokens,
+            "eval_duration": int(tokens * interval * 1e9),
+        }
+
+        if not request.get("stream", True):
+            time.sleep(tokens * interval)
+            text = " ".join(f"tok{i}" for i in range(tokens))
+            if is_chat:
+                final["message"] = {"role": "assistant", "content": text}
+            else:
+                final["response"] = text
+            self._send_json(final)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i in range(tokens):
+                time.sleep(interval)
+                piece = f"tok{i} "
+                frame = {"model": model, "done": False}
+                if is_chat:
+                    frame["message"] = {"role": "assistant", "content": piece}
+                else:
+                    frame["response"] = piece
+                self._chunk(frame)
+            if is_chat:
+                final["message"] = {"role": "assistant", "content": ""}
+            else:
+                final["response"] = ""
+            self._chunk(final)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # Client cancelled mid-stream
+            self.close_connection = True
+
+
+def fake_embedding(text: str) -> list:
+    """Deterministic bag-of-words vector so similarity search has structure."""
+    vector = [0.0] * EMBED_DIMENSIONS
+    for word in text.lower().split():
+        vector[hash(word) % EMBED_DIMENSIONS] += 1.0
+    return vector
+
+
+def start_backend(config: dict, models: list) -> tuple:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBackendHandler)
+    server.daemon_threads = True
+    server.config = config
+    server.models = models
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def scenario_call(name: str, i: int, args) -> tuple:
+    """Return (tool, arguments) for the i-th request of a scenario."""
+    if name == "chat":
+        return "chat", {"prompt": f"benchmark prompt {i}", "model": args.model, "stream": args.stream}
+    if name == "chat-dup":
+        return "chat", {"prompt": "benchmark prompt", "model": args.model, "stream": args.stream}
+    if name == "generate":
+        return "generate", {"prompt": f"benchmark prompt {i}", "model": args.model, "stream": args.stream}
+    if name == "embed":
+        return "embed_batch", {"texts": [f"chunk {i} part {j}" for j in range(args.embed_batch)]}
+    if name == "health":
+        return "health_check", {}
+    if name == "compare":
+        return "compare_models", {"prompt": f"benchmark prompt {i}", "models": "fast,smart"}
+    if name == "rag":
+        return "rag_search", {"query": f"topic {i % 7}", "workspace": "cf"}
+    raise ValueError(f"unknown scenario: {name}")
+
+
+def percentile(samples: list, q: float) -> float:
+    """Nearest-rank percentile of pre-sorted samples"""
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(q * len(samples))) - 1))
+    return samples[index]
+
+
+def classify(result) -> str:
+    if result is None:
+        return "error"
+    if getattr(result, "isError", False):
+        return "error"
+    text = result.content[0].text if getattr(result, "content", None) else ""
+    if text.startswith("Busy:"):
+        return "busy"
+    if text.startswith("Error"):
+        return "error"
+    return "ok"
+
+
+async def run_scenario(session, name: str, args) -> dict:
+    """Issue args.requests calls with at most args.concurrency in flight."""
+    latencies = []
+    outcomes = {"ok": 0, "error": 0, "busy": 0}
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one(i):
+        tool, arguments = scenario_call(name, i, args)
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(session.call_tool(tool, arguments), args.timeout)
+            except Exception:
+                result = None
+            latencies.append(time.perf_counter() - started)
+        outcomes[classify(result)] += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(args.requests)))
+    seconds = time.perf_counter() - started
+    latencies.sort()
+
+    failed = outcomes["error"] + outcomes["busy"]
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "ok": outcomes["ok"],
+        "errors": outcomes["error"],
+        "busy": outcomes["busy"],
+        "errorRate": round(failed / args.requests, 4) if args.requests else 0.0,
+        "seconds": round(seconds, 3),
+        "throughput": round(args.requests / seconds, 2) if seconds else 0.0,
+        "latency": {
+            "p50": round(percentile(latencies, 0.50), 4),
+            "p95": round(percentile(latencies, 0.95), 4),
+            "p99": round(percentile(latencies, 0.99), 4),
+            "mean": round(sum(latencies) / len(latencies), 4) if latencies else 0.0,
+            "max": round(latencies[-1], 4) if latencies else 0.0,
+        },
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def print_comparison(current: dict, baseline_path: str) -> None:
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nCompared with {baseline_path} ({baseline.get('commit') or 'unknown commit'}):", file=sys.stderr)
+    for name, result in current["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+
+        def delta(now, then):
+            return f"{(now - then) / then * 100:+.1f}%" if then else "n/a"
+
+        print(
+            f"  {name}: p50 {delta(result['latency']['p50'], before['latency']['p50'])}, "
+            f"p95 {delta(result['latency']['p95'], before['latency']['p95'])}, "
+            f"throughput {delta(result['throughput'], before['throughput'])}, "
+            f"error rate {before['errorRate']:.2%} -> {result['errorRate']:.2%}",
+            file=sys.stderr,
+        )
+
+
+async def run_benchmark(args) -> dict:
+    config = {
+        "latency": args.latency / 1000.0,
+        "jitter": args.jitter / 1000.0,
+        "token_rate": args.token_rate,
+        "tokens": args.tokens,
+        "failure_rate": args.failure_rate,
+        "drop_rate": args.drop_rate,
+        "documents": args.documents,
+    }
+
+    # The gateway reads its configuration at import time
+    scratch = tempfile.mkdtemp(prefix="aihub-bench-")
+    os.environ.setdefault("AIHUB_SCHEDULER", "0")
+    os.environ["AIHUB_EMBED_CACHE_DIR"] = os.path.join(scratch, "embeddings")
+    os.environ["AIHUB_RAG_INDEX_DIR"] = os.path.join(scratch, "rag")
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import server
+    from mcp.shared.memory import create_connected_server_and_client_session
+
+    backends = []
+    for endpoint in server.OLLAMA_ENDPOINTS.values():
+        backend, url = start_backend(config, endpoint["models"])
+        endpoint["url"] = url
+        backends.append(backend)
+    backend, server.ANYTHINGLLM_URL = start_backend(config, [])
+    backends.append(backend)
+
+    results = {}
+    try:
+        async with create_connected_server_and_client_session(server.mcp._mcp_server) as session:
+            for name in args.scenarios:
+                if args.warmup:
+                    warm = argparse.Namespace(**{**vars(args), "requests": min(args.warmup, args.requests)})
+                    await run_scenario(session, name, warm)
+                results[name] = await run_scenario(session, name, args)
+                summary = results[name]
+                print(
+                    f"{name}: p50 {summary['latency']['p50'] * 1000:.0f} ms, "
+                    f"p95 {summary['latency']['p95'] * 1000:.0f} ms, "
+                    f"p99 {summary['latency']['p99'] * 1000:.0f} ms, "
+                    f"{summary['throughput']} req/s, error rate {summary['errorRate']:.2%}",
+                    file=sys.stderr,
+                )
+    finally:
+        for backend in backends:
+            backend.shutdown()
+
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "config": {
+            **config,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "model": args.model,
+            "stream": args.stream,
+        },
+        "scenarios": results,
+        "gateway": server.metrics.summary(),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the AI-Hub MCP gateway against a fake backend")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS, help=f"Comma-separated: {', '.join(SCENARIOS)}")
+    parser.add_argument("--requests", type=int, default=100, help="Requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Concurrent requests in flight")
+    parser.add_argument("--warmup", type=int, default=5, help="Unrecorded requests before each scenario")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--model", default="fast", help="Model alias for chat/generate scenarios")
+    parser.add_argument("--no-stream", dest="stream", action="store_false", help="Use non-streaming chat/generate")
+    parser.add_argument("--embed-batch", type=int, default=16, help="Texts per embed_batch call")
+    parser.add_argument("--latency", type=float, default=20.0, help="Fake backend base latency in ms")
+    parser.add_argument("--jitter", type=float, default=10.0, help="Extra random latency in ms")
+    parser.add_argument("--token-rate", type=float, default=200.0, help="Fake generation speed in tokens/sec")
+    parser.add_argument("--tokens", type=int, default=20, help="Tokens per fake generation")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="Fraction of requests answered with HTTP 500")
+    parser.add_argument("--drop-rate", type=float, default=0.0, help="Fraction of connections dropped without a response")
+    parser.add_argument("--documents", type=int, default=20, help="Documents in the fake RAG workspace")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for jitter and failure injection")
+    parser.add_argument("--output", help="Write the JSON report to this path")
+    parser.add_argument("--compare", help="Previous JSON report to print deltas against")
+    return parser
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
+    args.scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in args.scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(unknown)}")
+    if args.requests < 1 or args.concurrency < 1 or args.token_rate <= 0:
+        parser.error("--requests, --concurrency and --token-rate must be positive")
+    if args.seed is not None:
+        random.seed(args.seed)
+    # Per-request INFO logging from the gateway and httpx would dominate the output
+    for name in ("httpx", "mcp", "server"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    report = asyncio.run(run_benchmark(args))
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(payload + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(payload)
+    if args.compare:
+        print_comparison(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
@@ -4,12 +4,36 @@ AI-Hub Ollama MCP Server
 Provides Claude Code access to distributed Ollama models across Tailscale network.
 """
 
+import asyncio
+import base64
+import functools
+import hashlib
+import heapq
 import json
+import mmap
+import os
+import sys
+import time
+from array import array
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager, contextmanager
+
 import httpx
-from mcp.server.fastmcp import FastMCP
+from mcp.server.fastmcp import Context, FastMCP
+from starlette.responses import PlainTextResponse
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: byte-range locks via msvcrt instead
+    fcntl = None
+    import msvcrt
 
 # AnythingLLM RAG Configuration
-import os
 ANYTHINGLLM_URL = "http://100.125.78.2:3001"
 ANYTHINGLLM_API_KEY = os.environ.get("ANYTHINGLLM_API_KEY", "")
 ANYTHINGLLM_WORKSPACES = {
@@ -24,12 +48,25 @@ OLLAMA_ENDPOINTS = {
     "hp": {
         "url": "http://100.107.62.43:11434",
         "name": "HP AI Node",
-        "models": ["qwen2.5:14b"]
+        "models": ["qwen2.5:14b"],
+        "max_concurrent": 2,
+        "num_ctx": int(os.environ.get("AIHUB_HP_NUM_CTX", "8192")),
+        "keep_alive": {
+            "hot": os.environ.get("AIHUB_HP_KEEP_ALIVE_HOT", "30m"),
+            "cold": os.environ.get("AIHUB_HP_KEEP_ALIVE_COLD", "5m"),
+        }
     },
     "pi": {
         "url": "http://100.125.78.2:11434",
         "name": "AI Pi",
-        "models": ["llama3.1:8b", "cniongolo/biomistral:latest", "nomic-embed-text:latest"]
+        "models": ["llama3.1:8b", "cniongolo/biomistral:latest", "nomic-embed-text:latest"],
+        "max_concurrent": 1,
+        "num_ctx": int(os.environ.get("AIHUB_PI_NUM_CTX", "4096")),
+        # Tight on RAM: idle models are released soon after their last use
+        "keep_alive": {
+            "hot": os.environ.get("AIHUB_PI_KEEP_ALIVE_HOT", "10m"),
+            "cold": os.environ.get("AIHUB_PI_KEEP_ALIVE_COLD", "1m"),
+        }
     }
 }
 
@@ -58,42 +95,1496 @@ MODEL_ROUTES = {
     "complex": ("hp", "qwen2.5:14b"),
 }
 
-mcp = FastMCP("AI-Hub Ollama Gateway")
+# Failover targets: models on other nodes that can stand in for a model
+MODEL_EQUIVALENTS = {
+    "qwen2.5:14b": [("pi", "llama3.1:8b")],
+    "llama3.1:8b": [("hp", "qwen2.5:14b")],
+    "cniongolo/biomistral:latest": [("hp", "qwen2.5:14b")],
+}
 
+# Context windows in tokens (max_tokens in litellm/config.yaml): upper bounds only. Each
+# node's num_ctx (sized for its RAM) is what is actually requested and budgeted against.
+MODEL_CONTEXT = {
+    "qwen2.5:14b": 32768,
+    "qwen2.5:32b": 32768,
+    "qwen2.5-coder:7b": 32768,
+    "llama3.1:8b": 8192,
+    "cniongolo/biomistral:latest": 8192,
+}
+DEFAULT_CONTEXT = int(os.environ.get("AIHUB_DEFAULT_CONTEXT", "8192"))
+CHARS_PER_TOKEN = float(os.environ.get("AIHUB_CHARS_PER_TOKEN", "4"))
+RESPONSE_RESERVE = int(os.environ.get("AIHUB_RESPONSE_RESERVE", "1024"))  # tokens kept free for the reply
+MESSAGE_OVERHEAD = 4             # chat-template tokens per message
+OVERFLOW_MODES = ("truncate", "map_reduce", "error")
+MAP_REDUCE_MAX_CHUNKS = int(os.environ.get("AIHUB_MAP_REDUCE_MAX_CHUNKS", "16"))
+MAP_REDUCE_CONCURRENCY = 2
+MAP_REDUCE_TASK_TOKENS = 512     # a trailing paragraph up to this size is treated as the question
+
+# Routing engine tuning
+ROUTER_PS_TTL = float(os.environ.get("AIHUB_ROUTER_PS_TTL", "15"))
+ROUTER_PS_TIMEOUT = 2.0
+ROUTER_FAILURE_THRESHOLD = int(os.environ.get("AIHUB_ROUTER_FAILURE_THRESHOLD", "2"))
+ROUTER_RETRY_AFTER = float(os.environ.get("AIHUB_ROUTER_RETRY_AFTER", "30"))
+ROUTER_DEFAULT_LATENCY = 5.0     # seconds assumed for a node with no history
+ROUTER_COLD_PENALTY = 10.0       # seconds added when the model is not loaded
+ROUTER_FALLBACK_PENALTY = 30.0   # seconds added per step away from the primary route
+ROUTER_LATENCY_ALPHA = 0.3       # EWMA weight of the newest latency sample
+ROUTER_DECISION_LOG = 50
+
+# Admission control: per-node queue behind max_concurrent running requests
+NODE_MAX_QUEUE = int(os.environ.get("AIHUB_NODE_MAX_QUEUE", "8"))
+NODE_MAX_WAIT = float(os.environ.get("AIHUB_NODE_MAX_WAIT", "60"))
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+QUEUE_WAIT_SAMPLES = 200
+
+# Batch embedding: inputs per /api/embed call, bounded by count and characters
+EMBED_BATCH_SIZE = int(os.environ.get("AIHUB_EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_MAX_CHARS = int(os.environ.get("AIHUB_EMBED_BATCH_MAX_CHARS", "32000"))
+EMBED_CONCURRENCY = int(os.environ.get("AIHUB_EMBED_CONCURRENCY", "2"))
+
+# Warm-up and keep_alive scheduling
+SCHEDULER_ENABLED = os.environ.get("AIHUB_SCHEDULER", "1").lower() not in ("0", "false", "no")
+SCHEDULER_INTERVAL = float(os.environ.get("AIHUB_SCHEDULER_INTERVAL", "60"))
+WARM_ALIASES = [a.strip() for a in os.environ.get("AIHUB_WARM_ALIASES", "smart,fast,embed").split(",") if a.strip()]
+USAGE_HALF_LIFE = 600.0   # seconds for a model's usage score to halve
+HOT_SCORE = 1.5           # decayed uses at which a model counts as hot
+
+# Metrics: Prometheus text endpoint (0 = off; HTTP transports also serve /metrics)
+METRICS_PORT = int(os.environ.get("AIHUB_METRICS_PORT", "0"))
+METRICS_HOST = os.environ.get("AIHUB_METRICS_HOST", "127.0.0.1")
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+TOKEN_RATE_BUCKETS = (1.0, 2.0, 5.0, 10.0, 20.0, 40.0, 80.0, 160.0)
+
+# Response cache (opt-in): by default only temperature-0 requests are cached
+RESPONSE_CACHE_ENABLED = os.environ.get("AIHUB_RESPONSE_CACHE", "").lower() in ("1", "true", "yes")
+RESPONSE_CACHE_TTL = float(os.environ.get("AIHUB_RESPONSE_CACHE_TTL", "3600"))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("AIHUB_RESPONSE_CACHE_MAX_ENTRIES", "256"))
+RESPONSE_CACHE_DIR = os.environ.get("AIHUB_RESPONSE_CACHE_DIR", "")
+RESPONSE_CACHE_MAX_DISK_ENTRIES = int(os.environ.get("AIHUB_RESPONSE_CACHE_MAX_DISK_ENTRIES", "4096"))
+
+# Persistent embedding cache (content hash -> vector); AIHUB_EMBED_CACHE=0 disables it
+EMBED_CACHE_ENABLED = os.environ.get("AIHUB_EMBED_CACHE", "1").lower() not in ("0", "false", "no")
+EMBED_CACHE_DIR = os.environ.get(
+    "AIHUB_EMBED_CACHE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "aihub-mcp", "embeddings")
+)
+
+# Local vector index for rag_search (one directory per workspace)
+RAG_INDEX_DIR = os.environ.get(
+    "AIHUB_RAG_INDEX_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "aihub-mcp", "rag")
+)
+RAG_CHUNK_CHARS = int(os.environ.get("AIHUB_RAG_CHUNK_CHARS", "1200"))
+RAG_CHUNK_OVERLAP = 200
+RAG_FETCH_CONCURRENCY = 4
+RAG_LOCAL_EXTENSIONS = (".md", ".markdown", ".txt")
+RAG_CHECK_INTERVAL = float(os.environ.get("AIHUB_RAG_CHECK_INTERVAL", "60"))  # seconds between staleness checks
+
+# Shared HTTP connection pools (one client per endpoint, reused across tool calls)
+HTTP_MAX_CONNECTIONS = int(os.environ.get("AIHUB_HTTP_MAX_CONNECTIONS", "8"))
+HTTP_MAX_KEEPALIVE = int(os.environ.get("AIHUB_HTTP_MAX_KEEPALIVE", "4"))
+HTTP_KEEPALIVE_EXPIRY = float(os.environ.get("AIHUB_HTTP_KEEPALIVE_EXPIRY", "60"))
+HTTP_CONNECT_TIMEOUT = 5.0
+
+# Streaming: minimum seconds between incremental-output notifications
+STREAM_NOTIFY_INTERVAL = float(os.environ.get("AIHUB_STREAM_NOTIFY_INTERVAL", "0.5"))
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def get_client(endpoint_key: str) -> httpx.AsyncClient:
+    """
+    Return the pooled client for an Ollama endpoint key or "anythingllm".
+    Clients are created lazily and keep connections alive between calls.
+    """
+    client = _clients.get(endpoint_key)
+    if client is not None and not client.is_closed:
+        return client
 
-@mcp.tool()
-async def list_models() -> str:
+    headers = {}
+    if endpoint_key == "anythingllm":
+        base_url = ANYTHINGLLM_URL
+        if ANYTHINGLLM_API_KEY:
+            headers["Authorization"] = f"Bearer {ANYTHINGLLM_API_KEY}"
+    else:
+        base_url = OLLAMA_ENDPOINTS[endpoint_key]["url"]
+
+    client = httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers,
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(60.0, connect=HTTP_CONNECT_TIMEOUT),
+    )
+    _clients[endpoint_key] = client
+    return client
+
+
+def request_timeout(seconds: float) -> httpx.Timeout:
     """
-    Lists all available models across the AI-Hub network.
-    Shows which models are running on HP and Pi devices.
+    Per-request timeout that keeps the short connect timeout. A bare float
+    would override the client's Timeout entirely, so an unreachable node
+    would hold a request for the full read budget before failover.
     """
-    result = []
+    return httpx.Timeout(seconds, connect=min(HTTP_CONNECT_TIMEOUT, seconds))
+
+
+async def close_clients() -> None:
+    """Close every pooled client (called on server shutdown)."""
+    clients = list(_clients.values())
+    _clients.clear()
+    await asyncio.gather(*(c.aclose() for c in clients), return_exceptions=True)
+
+
+_sessions = 0
+
+
+@asynccontextmanager
+async def lifespan(server):
+    """
+    FastMCP runs the lifespan once per session under the HTTP transports,
+    so the shared pools and the scheduler are reference-counted: the first
+    session starts them and the last one to end closes them. The metrics
+    listener is started once and serves for the life of the process.
+    """
+    global _sessions
+    _sessions += 1
+    if _sessions == 1 and SCHEDULER_ENABLED:
+        model_scheduler.start()
+    await start_metrics_server()
+    try:
+        yield {}
+    finally:
+        _sessions -= 1
+        if _sessions == 0:
+            await model_scheduler.stop()
+            await close_clients()
+
+
+mcp = FastMCP("AI-Hub Ollama Gateway", lifespan=lifespan)
+
+METRIC_HELP = {
+    "aihub_tool_requests_total": ("counter", "MCP tool calls by tool and status (ok, error, busy, cancelled)."),
+    "aihub_tool_duration_seconds": ("histogram", "MCP tool call latency."),
+    "aihub_node_requests_total": ("counter", "Requests sent to an Ollama node by model and status."),
+    "aihub_node_duration_seconds": ("histogram", "Ollama node request latency."),
+    "aihub_ttft_seconds": ("histogram", "Time to first streamed token."),
+    "aihub_prompt_tokens_total": ("counter", "Prompt tokens evaluated (Ollama prompt_eval_count)."),
+    "aihub_eval_tokens_total": ("counter", "Tokens generated (Ollama eval_count)."),
+    "aihub_tokens_per_second": ("histogram", "Generation speed from eval_count / eval_duration."),
+    "aihub_embed_inputs_total": ("counter", "Texts embedded, by source (cache or model)."),
+    "aihub_prompt_overflow_total": ("counter", "Prompts over a model's context budget, by action taken."),
+    "aihub_node_in_flight": ("gauge", "Requests running or queued per node."),
+    "aihub_node_queue_depth": ("gauge", "Requests waiting in a node's admission queue."),
+    "aihub_node_healthy": ("gauge", "1 if the router considers the node healthy."),
+    "aihub_response_cache_hit_ratio": ("gauge", "Response cache hit ratio since start."),
+}
+
+
+class Metrics:
+    """
+    In-process Prometheus-style counters and histograms.
+
+    Series are keyed by (name, sorted label tuple). render() produces the
+    text exposition format, and summary() a JSON-friendly view with
+    histogram quantiles interpolated from the buckets.
+    """
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name: str, labels: dict, value: float = 1.0) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0.0) + value
+
+    def observe(self, name: str, labels: dict, value: float, buckets: tuple = LATENCY_BUCKETS) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = {"buckets": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["counts"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+    def observe_generation(self, device_key: str, model_name: str, data: dict, ttft: float = None) -> None:
+        """Record TTFT and Ollama's token accounting from a final response frame."""
+        labels = {"node": device_key, "model": model_name}
+        if ttft is not None:
+            self.observe("aihub_ttft_seconds", labels, ttft)
+        if data.get("prompt_eval_count"):
+            self.inc("aihub_prompt_tokens_total", labels, data["prompt_eval_count"])
+        if data.get("eval_count"):
+            self.inc("aihub_eval_tokens_total", labels, data["eval_count"])
+            if data.get("eval_duration"):
+                rate = data["eval_count"] / (data["eval_duration"] / 1e9)
+                self.observe("aihub_tokens_per_second", labels, rate, TOKEN_RATE_BUCKETS)
+
+    @staticmethod
+    def quantile(histogram: dict, q: float) -> float:
+        if not histogram["count"]:
+            return 0.0
+        rank = q * histogram["count"]
+        seen, lower = 0, 0.0
+        for bound, count in zip(histogram["buckets"], histogram["counts"]):
+            if count and seen + count >= rank:
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return histogram["buckets"][-1]
+
+    @staticmethod
+    def _labels(labels) -> str:
+        if not labels:
+            return ""
+        escaped = (f'{k}="{str(v).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"' for k, v in labels)
+        return "{" + ",".join(escaped) + "}"
+
+    def gauges(self) -> list:
+        samples = []
+        for key, node in router.nodes.items():
+            gate = router.gates[key]
+            samples.append(("aihub_node_in_flight", (("node", key),), node["inFlight"]))
+            samples.append(("aihub_node_queue_depth", (("node", key),), len(gate.waiting)))
+            samples.append(("aihub_node_healthy", (("node", key),), 1 if node["healthy"] else 0))
+        samples.append(("aihub_response_cache_hit_ratio", (), response_cache.stats()["hitRate"]))
+        return samples
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        series = {}
+        for (name, labels), value in self.counters.items():
+            series.setdefault(name, []).append(f"{name}{self._labels(labels)} {value:g}")
+        for (name, labels), h in self.histograms.items():
+            lines = series.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(h["buckets"], h["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{self._labels(labels + (('le', f'{bound:g}'),))} {cumulative}")
+            lines.append(f"{name}_bucket{self._labels(labels + (('le', '+Inf'),))} {h['count']}")
+            lines.append(f"{name}_sum{self._labels(labels)} {h['sum']:g}")
+            lines.append(f"{name}_count{self._labels(labels)} {h['count']}")
+        for name, labels, value in self.gauges():
+            series.setdefault(name, []).append(f"{name}{self._labels(labels)} {value:g}")
+
+        out = []
+        for name in sorted(series):
+            kind, text = METRIC_HELP.get(name, ("untyped", name))
+            out.append(f"# HELP {name} {text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(series[name])
+        return "\n".join(out) + "\n"
+
+    def summary(self) -> dict:
+        result = {}
+        for (name, labels), value in sorted(self.counters.items()):
+            result.setdefault(name, []).append({**dict(labels), "value": value})
+        for (name, labels), h in sorted(self.histograms.items()):
+            result.setdefault(name, []).append({
+                **dict(labels),
+                "count": h["count"],
+                "mean": round(h["sum"] / h["count"], 4) if h["count"] else 0.0,
+                "p50": round(self.quantile(h, 0.5), 4),
+                "p95": round(self.quantile(h, 0.95), 4),
+                "p99": round(self.quantile(h, 0.99), 4),
+            })
+        for name, labels, value in self.gauges():
+            result.setdefault(name, []).append({**dict(labels), "value": value})
+        return result
+
+
+metrics = Metrics()
+
+
+def result_status(result) -> str:
+    """Classify a tool's string result: tools report failures in-band."""
+    if isinstance(result, str):
+        if result.startswith("Error"):
+            return "error"
+        if result.startswith("Busy:"):
+            return "busy"
+    return "ok"
+
+
+def instrumented(fn):
+    """Count calls, outcomes and latency of an MCP tool."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        status = "error"
+        try:
+            result = await fn(*args, **kwargs)
+            status = result_status(result)
+            return result
+        except asyncio.CancelledError:
+            status = "cancelled"
+            raise
+        finally:
+            metrics.inc("aihub_tool_requests_total", {"tool": fn.__name__, "status": status})
+            metrics.observe("aihub_tool_duration_seconds", {"tool": fn.__name__}, time.perf_counter() - started)
+    return wrapper
+
+
+async def _serve_metrics(reader, writer) -> None:
+    """Answer one HTTP request on the standalone metrics port."""
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 5.0)
+        parts = head.split(b" ", 2)
+        if len(parts) > 1 and parts[1].split(b"?")[0] == b"/metrics":
+            status, body = b"200 OK", metrics.render().encode("utf-8")
+        else:
+            status, body = b"404 Not Found", b"not found\n"
+        writer.write(
+            b"HTTP/1.1 " + status + b"\r\n"
+            b"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            b"Content-Length: " + str(len(body)).encode() + b"\r\n"
+            b"Connection: close\r\n\r\n" + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+_metrics_server_started = False
+_metrics_server = None
+
+
+async def start_metrics_server() -> None:
+    """
+    Serve /metrics on AIHUB_METRICS_PORT (useful for the stdio transport).
+    Runs at most once per process, however many sessions call it.
+    """
+    global _metrics_server, _metrics_server_started
+    if not METRICS_PORT or _metrics_server_started:
+        return
+    _metrics_server_started = True
+    try:
+        _metrics_server = await asyncio.start_server(_serve_metrics, METRICS_HOST, METRICS_PORT)
+    except OSError as e:
+        # Another gateway instance may already own the port; keep serving MCP
+        print(f"AI-Hub metrics endpoint disabled: {e}", file=sys.stderr)
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def metrics_endpoint(request):
+    """Prometheus scrape target when running with an HTTP transport."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def fan_out(jobs: dict, timeout: float, ctx: Context = None):
+    """
+    Run the coroutines in ``jobs`` concurrently, each bounded by ``timeout``.
+    Yields (key, result, error, seconds) in completion order so callers can
+    surface partial results while slower nodes are still answering.
+    """
+    async def run(key, coro):
+        started = time.perf_counter()
+        try:
+            result = await asyncio.wait_for(coro, timeout)
+            return key, result, None, time.perf_counter() - started
+        except asyncio.TimeoutError:
+            error = httpx.TimeoutException(f"timed out after {timeout:g}s")
+            return key, None, error, time.perf_counter() - started
+        except Exception as e:
+            return key, None, e, time.perf_counter() - started
+
+    tasks = [asyncio.create_task(run(key, coro)) for key, coro in jobs.items()]
+    try:
+        for done, future in enumerate(asyncio.as_completed(tasks), 1):
+            item = await future
+            await report_progress(ctx, done, len(tasks))
+            yield item
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def notify(ctx: Context, message: str) -> None:
+    """Send a partial result to the MCP client as a log message, if connected."""
+    if ctx is None:
+        return
+    try:
+        await ctx.info(message)
+    except Exception:
+        pass
+
+
+async def report_progress(ctx: Context, progress: float, total: float = None) -> None:
+    """Send a progress notification, if connected; a gone client must not fail the request."""
+    if ctx is None:
+        return
+    try:
+        await ctx.report_progress(progress, total)
+    except Exception:
+        pass
+
+
+async def stream_ollama(
+    device_key: str,
+    path: str,
+    payload: dict,
+    timeout: float,
+    ctx: Context = None
+) -> tuple[str, dict]:
+    """
+    POST a streaming request to /api/chat or /api/generate and collect the
+    NDJSON frames. Text is forwarded to the client every STREAM_NOTIFY_INTERVAL
+    seconds. Cancelling the calling task closes the connection, which makes
+    Ollama stop generating. Returns (text, stats).
+    """
+    pieces = []
+    pending = []
+    chunks = 0
+    first_token = None
+    final = {}
+    started = time.perf_counter()
+    last_notify = started
+
+    client = get_client(device_key)
+    async with client.stream("POST", path, json={**payload, "stream": True}, timeout=request_timeout(timeout)) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line.strip():
+                continue
+            frame = json.loads(line)
+            if "error" in frame:
+                raise RuntimeError(frame["error"])
+
+            if path == "/api/chat":
+                piece = frame.get("message", {}).get("content", "")
+            else:
+                piece = frame.get("response", "")
+            if piece:
+                if first_token is None:
+                    first_token = time.perf_counter()
+                chunks += 1
+                pieces.append(piece)
+                pending.append(piece)
+
+            now = time.perf_counter()
+            done = frame.get("done", False)
+            if ctx is not None and pending and (done or now - last_notify >= STREAM_NOTIFY_INTERVAL):
+                await report_progress(ctx, chunks)
+                await notify(ctx, "".join(pending))
+                pending.clear()
+                last_notify = now
+            if done:
+                final = frame
+                break
+
+    seconds = time.perf_counter() - started
+    tokens = final.get("eval_count", chunks)
+    if final.get("eval_duration"):
+        tokens_per_second = tokens / (final["eval_duration"] / 1e9)
+    elif first_token is not None and seconds > first_token - started:
+        tokens_per_second = tokens / (seconds - (first_token - started))
+    else:
+        tokens_per_second = 0.0
+
+    ttft = (first_token - started) if first_token is not None else None
+    metrics.observe_generation(device_key, payload["model"], final, ttft)
+    stats = {
+        "ttft": ttft,
+        "tokens": tokens,
+        "tokensPerSecond": tokens_per_second,
+        "seconds": seconds,
+    }
+    return "".join(pieces), stats
+
+
+def format_stream_stats(stats: dict) -> str:
+    ttft = f"{stats['ttft']:.2f}s" if stats["ttft"] is not None else "n/a"
+    return (
+        f"[TTFT {ttft}, {stats['tokensPerSecond']:.1f} tok/s, "
+        f"{stats['tokens']} tokens, {stats['seconds']:.2f}s total]"
+    )
+
+
+async def fetch_tags(device_key: str) -> dict:
+    """GET /api/tags from one node, raising on HTTP errors."""
+    response = await get_client(device_key).get("/api/tags")
+    response.raise_for_status()
+    return response.json()
+
+
+def resolve_route(model: str) -> tuple[str, str]:
+    """Map an alias or model name to its primary (device, model) route."""
+    model_lower = model.lower()
+
+    if model_lower in MODEL_ROUTES:
+        return MODEL_ROUTES[model_lower]
+
+    # Try to find direct model match
+    for dk, device in OLLAMA_ENDPOINTS.items():
+        if model_lower in [m.lower() for m in device["models"]]:
+            return dk, model
+
+    # Default to smart
+    return MODEL_ROUTES["smart"]
+
+
+def is_failover_error(error: Exception) -> bool:
+    """Errors that mean "try another node" rather than "the request is bad"."""
+    if isinstance(error, (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return True
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code == 404 or error.response.status_code >= 500
+    return False
+
+
+class NodeBusy(Exception):
+    """Raised when a node sheds a request instead of queueing it."""
+
+
+class AdmissionGate:
+    """
+    Bounded priority queue in front of one node.
+
+    At most ``limit`` requests run at once. Up to ``max_queue`` more wait,
+    ordered by priority (0 = high) then arrival. A full queue sheds the
+    lowest-priority request immediately, and a request that waits longer
+    than ``max_wait`` is shed too. Shed requests get NodeBusy.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, max_wait: float):
+        self.name = name
+        self.limit = max(1, limit)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.active = 0
+        self.waiting = []
+        self.sequence = 0
+        self.waits = deque(maxlen=QUEUE_WAIT_SAMPLES)
+        self.counters = {"admitted": 0, "shed": 0, "evicted": 0, "timedOut": 0}
+
+    async def acquire(self, priority: int = 1) -> None:
+        if self.active < self.limit and not self.waiting:
+            self.active += 1
+            self.counters["admitted"] += 1
+            self.waits.append(0.0)
+            return
+
+        if len(self.waiting) >= self.max_queue:
+            worst = max(self.waiting, default=None)
+            if worst is None or worst[0] <= priority:
+                self.counters["shed"] += 1
+                raise NodeBusy(f"{self.name} is busy ({self.active} running, {len(self.waiting)} queued)")
+            # Make room by shedding a lower-priority waiter
+            self.waiting.remove(worst)
+            heapq.heapify(self.waiting)
+            worst[2].set_exception(NodeBusy(f"{self.name} is busy (preempted by a higher-priority request)"))
+            self.counters["evicted"] += 1
+
+        started = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        self.sequence += 1
+        entry = (priority, self.sequence, future)
+        heapq.heappush(self.waiting, entry)
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except asyncio.TimeoutError:
+            self._abandon(entry)
+            self.counters["timedOut"] += 1
+            raise NodeBusy(f"{self.name} is busy (waited {self.max_wait:g}s in queue)")
+        except asyncio.CancelledError:
+            self._abandon(entry)
+            raise
+        self.counters["admitted"] += 1
+        self.waits.append(time.perf_counter() - started)
+
+    def _abandon(self, entry: tuple) -> None:
+        """Leave the queue; hand the slot on if it was granted in the meantime."""
+        future = entry[2]
+        if entry in self.waiting:
+            self.waiting.remove(entry)
+            heapq.heapify(self.waiting)
+        if future.done() and not future.cancelled() and future.exception() is None:
+            self.release()
+        elif not future.done():
+            future.cancel()
+
+    def release(self) -> None:
+        self.active -= 1
+        while self.waiting and self.active < self.limit:
+            _, _, future = heapq.heappop(self.waiting)
+            if not future.done():
+                self.active += 1
+                future.set_result(None)
+
+    def stats(self) -> dict:
+        waits = sorted(self.waits)
+
+        def percentile(q):
+            return round(waits[min(len(waits) - 1, int(q * len(waits)))], 3) if waits else 0.0
+
+        return {
+            **self.counters,
+            "running": self.active,
+            "limit": self.limit,
+            "queued": len(self.waiting),
+            "maxQueue": self.max_queue,
+            "waitP50": percentile(0.5),
+            "waitP95": percentile(0.95),
+            "waitMax": round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+_coalesced = {}
+coalesce_counters = {"leaders": 0, "followers": 0}
+
+
+async def coalesce(key: str, factory):
+    """
+    Single-flight: concurrent callers with the same key share one run of
+    ``factory()``. The shared task is cancelled only when its last waiter
+    goes away, so one cancelled caller does not break the others.
+    """
+    entry = _coalesced.get(key)
+    if entry is None:
+        entry = {"task": asyncio.ensure_future(factory()), "waiters": 0}
+        _coalesced[key] = entry
+        entry["task"].add_done_callback(lambda _task: _coalesced.pop(key, None))
+        coalesce_counters["leaders"] += 1
+    else:
+        coalesce_counters["followers"] += 1
 
-    async with httpx.AsyncClient(timeout=10.0) as client:
+    entry["waiters"] += 1
+    try:
+        return await asyncio.shield(entry["task"])
+    except asyncio.CancelledError:
+        if entry["waiters"] == 1 and not entry["task"].done():
+            entry["task"].cancel()
+        raise
+    finally:
+        entry["waiters"] -= 1
+
+
+class Router:
+    """
+    Load- and health-aware replica selection for model requests.
+
+    Tracks per node: health (consecutive transport failures), in-flight
+    requests, an EWMA of recent latency and the models loaded in memory
+    (from /api/ps). Candidates are the primary route, the same model on
+    other nodes and MODEL_EQUIVALENTS. They are ranked by expected wait:
+
+        latency * (1 + in_flight) + cold-model penalty + fallback penalty
+
+    Unhealthy nodes are skipped until ROUTER_RETRY_AFTER has passed.
+    Each node is fronted by an AdmissionGate; a busy node fails over like
+    an unreachable one but is not marked unhealthy.
+    """
+
+    def __init__(self):
+        self.nodes = {
+            key: {
+                "healthy": True,
+                "failures": 0,
+                "inFlight": 0,
+                "latency": None,
+                "loaded": [],
+                "psCheckedAt": 0.0,
+                "downSince": None,
+                "lastError": None,
+                "usage": {},
+            }
+            for key in OLLAMA_ENDPOINTS
+        }
+        self.decisions = deque(maxlen=ROUTER_DECISION_LOG)
+        self._refreshing = set()
+        self.gates = {
+            key: AdmissionGate(device["name"], device.get("max_concurrent", 1), NODE_MAX_QUEUE, NODE_MAX_WAIT)
+            for key, device in OLLAMA_ENDPOINTS.items()
+        }
+
+    def record_success(self, device_key: str, seconds: float = None) -> None:
+        node = self.nodes[device_key]
+        node.update(healthy=True, failures=0, downSince=None)
+        if seconds is not None:
+            if node["latency"] is None:
+                node["latency"] = seconds
+            else:
+                node["latency"] += ROUTER_LATENCY_ALPHA * (seconds - node["latency"])
+
+    def record_use(self, device_key: str, model_name: str) -> None:
+        """Bump the model's exponentially decayed usage score."""
+        now = time.monotonic()
+        usage = self.nodes[device_key]["usage"].setdefault(model_name, {"last": now, "score": 0.0})
+        usage["score"] = usage["score"] * 0.5 ** ((now - usage["last"]) / USAGE_HALF_LIFE) + 1
+        usage["last"] = now
+
+    def usage_score(self, device_key: str, model_name: str) -> float:
+        usage = self.nodes[device_key]["usage"].get(model_name)
+        if usage is None:
+            return 0.0
+        return usage["score"] * 0.5 ** ((time.monotonic() - usage["last"]) / USAGE_HALF_LIFE)
+
+    def record_failure(self, device_key: str, error: Exception) -> None:
+        node = self.nodes[device_key]
+        node["failures"] += 1
+        node["lastError"] = f"{type(error).__name__}: {error}"
+        if node["failures"] >= ROUTER_FAILURE_THRESHOLD:
+            node["healthy"] = False
+            node["downSince"] = time.monotonic()
+
+    def is_available(self, device_key: str) -> bool:
+        node = self.nodes[device_key]
+        if node["healthy"]:
+            return True
+        # Half-open: let one request probe a node that has been down a while
+        return time.monotonic() - node["downSince"] >= ROUTER_RETRY_AFTER
+
+    async def refresh_loaded(self, device_key: str, force: bool = False) -> None:
+        """Refresh the node's loaded-model list from /api/ps (at most every ROUTER_PS_TTL)."""
+        node = self.nodes[device_key]
+        if not self.is_available(device_key):
+            return
+        if not force and time.monotonic() - node["psCheckedAt"] < ROUTER_PS_TTL:
+            return
+        node["psCheckedAt"] = time.monotonic()
+        try:
+            response = await get_client(device_key).get("/api/ps", timeout=request_timeout(ROUTER_PS_TIMEOUT))
+            response.raise_for_status()
+            node["loaded"] = [m.get("name") for m in response.json().get("models", [])]
+            self.record_success(device_key)
+        except httpx.TransportError as e:
+            self.record_failure(device_key, e)
+        except Exception:
+            pass
+
+    def score(self, device_key: str, model_name: str, rank: int) -> float:
+        node = self.nodes[device_key]
+        latency = node["latency"] if node["latency"] is not None else ROUTER_DEFAULT_LATENCY
+        cost = latency * (1 + node["inFlight"]) + rank * ROUTER_FALLBACK_PENALTY
+        if model_name not in node["loaded"]:
+            cost += ROUTER_COLD_PENALTY
+        return cost
+
+    async def plan(self, model: str, record: bool = True) -> dict:
+        """Rank the replicas for ``model`` and return the routing decision."""
+        primary = resolve_route(model)
+        candidates = [primary]
         for device_key, device in OLLAMA_ENDPOINTS.items():
+            if (device_key, primary[1]) not in candidates and primary[1] in device["models"]:
+                candidates.append((device_key, primary[1]))
+        for equivalent in MODEL_EQUIVALENTS.get(primary[1], []):
+            if equivalent not in candidates:
+                candidates.append(equivalent)
+
+        # Refresh stale /api/ps data in the background; planning never waits on it
+        for key in {key for key, _ in candidates}:
+            task = asyncio.create_task(self.refresh_loaded(key))
+            self._refreshing.add(task)
+            task.add_done_callback(self._refreshing.discard)
+
+        scored = []
+        for rank, (device_key, model_name) in enumerate(candidates):
+            scored.append({
+                "node": device_key,
+                "model": model_name,
+                "available": self.is_available(device_key),
+                "score": round(self.score(device_key, model_name, rank), 3),
+                "inFlight": self.nodes[device_key]["inFlight"],
+                "loaded": model_name in self.nodes[device_key]["loaded"],
+            })
+        # Unavailable nodes go last rather than being dropped: if everything
+        # is down, still try them in order.
+        scored.sort(key=lambda c: (not c["available"], c["score"]))
+
+        decision = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "request": model,
+            "primary": {"node": primary[0], "model": primary[1]},
+            "candidates": scored,
+            "attempts": [],
+            "served": None,
+        }
+        if record:
+            self.decisions.append(decision)
+        return decision
+
+    async def call(self, decision: dict, request, priority: int = PRIORITIES["normal"]):
+        """
+        Run ``request(device_key, model_name)`` on the ranked candidates,
+        failing over to the next one on connection errors, 404, 5xx and
+        NodeBusy. Each attempt first passes the node's admission gate.
+        """
+        last_error = None
+        for candidate in decision["candidates"]:
+            device_key, model_name = candidate["node"], candidate["model"]
+            node = self.nodes[device_key]
+            gate = self.gates[device_key]
+            attempt = {"node": device_key, "model": model_name}
+            decision["attempts"].append(attempt)
+            node["inFlight"] += 1
+            try:
+                await gate.acquire(priority)
+            except NodeBusy as e:
+                node["inFlight"] -= 1
+                attempt["error"] = f"NodeBusy: {e}"
+                metrics.inc("aihub_node_requests_total", {"node": device_key, "model": model_name, "status": "busy"})
+                last_error = e
+                continue
+            except BaseException:
+                node["inFlight"] -= 1
+                raise
+            started = time.perf_counter()
+            status = "error"
+            try:
+                result = await request(device_key, model_name)
+                status = "ok"
+            except asyncio.CancelledError:
+                status = "cancelled"
+                raise
+            except Exception as e:
+                attempt["error"] = f"{type(e).__name__}: {e}"
+                if isinstance(e, httpx.TransportError):
+                    self.record_failure(device_key, e)
+                if not is_failover_error(e):
+                    raise
+                last_error = e
+                continue
+            finally:
+                node["inFlight"] -= 1
+                gate.release()
+                labels = {"node": device_key, "model": model_name}
+                metrics.inc("aihub_node_requests_total", {**labels, "status": status})
+                metrics.observe("aihub_node_duration_seconds", labels, time.perf_counter() - started)
+            self.record_success(device_key, time.perf_counter() - started)
+            self.record_use(device_key, model_name)
+            decision["served"] = attempt
+            return device_key, model_name, result
+        raise last_error
+
+    def status(self) -> dict:
+        return {
+            "nodes": {
+                key: {**node, "available": self.is_available(key)}
+                for key, node in self.nodes.items()
+            },
+            "queues": {key: gate.stats() for key, gate in self.gates.items()},
+            "coalescing": {**coalesce_counters, "inFlight": len(_coalesced)},
+            "scheduler": model_scheduler.status(),
+            "decisions": list(self.decisions),
+        }
+
+
+router = Router()
+
+
+class ModelScheduler:
+    """
+    Keeps frequently used models resident and lets idle ones expire.
+
+    - Startup: loads the models behind WARM_ALIASES, one at a time per node.
+    - Per request: keep_alive_for() gives hot models (decayed usage score
+      >= HOT_SCORE) the node's hot keep_alive and everything else its
+      short cold one, so Ollama itself frees memory held by idle models
+      (within a minute on the Pi).
+    - Every SCHEDULER_INTERVAL: reloads hot models Ollama has evicted.
+
+    Models are never unloaded explicitly: usage counters only cover this
+    process, while other gateway instances and direct Ollama clients may
+    be using the same models.
+    """
+
+    def __init__(self):
+        self.task = None
+        self.actions = deque(maxlen=ROUTER_DECISION_LOG)
+
+    def is_hot(self, device_key: str, model_name: str) -> bool:
+        return router.usage_score(device_key, model_name) >= HOT_SCORE
+
+    def keep_alive_for(self, device_key: str, model_name: str) -> str:
+        keep_alive = OLLAMA_ENDPOINTS[device_key]["keep_alive"]
+        return keep_alive["hot"] if self.is_hot(device_key, model_name) else keep_alive["cold"]
+
+    async def _load(self, device_key: str, model_name: str) -> None:
+        """Load a model with the node's hot keep_alive without generating anything."""
+        keep_alive = OLLAMA_ENDPOINTS[device_key]["keep_alive"]["hot"]
+        if "embed" in model_name:
+            path, payload = "/api/embed", {"model": model_name, "input": "warm-up", "keep_alive": keep_alive}
+        else:
+            # Same num_ctx as chat/generate, or the first request would reload the model
+            path, payload = "/api/generate", {
+                "model": model_name,
+                "keep_alive": keep_alive,
+                "options": context_options({}, device_key, model_name)
+            }
+        action = {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "action": "warm",
+            "node": device_key,
+            "model": model_name,
+        }
+        try:
+            response = await get_client(device_key).post(path, json=payload, timeout=request_timeout(300.0))
+            response.raise_for_status()
+        except Exception as e:
+            action["error"] = f"{type(e).__name__}: {e}"
+            if isinstance(e, httpx.TransportError):
+                router.record_failure(device_key, e)
+        self.actions.append(action)
+
+    async def warm_up(self) -> None:
+        per_node = {}
+        for alias in WARM_ALIASES:
+            device_key, model_name = resolve_route(alias)
+            if model_name not in per_node.setdefault(device_key, []):
+                per_node[device_key].append(model_name)
+
+        async def warm_node(device_key, models):
+            for model_name in models:
+                await self._load(device_key, model_name)
+                # Counts as a use so the model starts out with the hot keep_alive
+                router.record_use(device_key, model_name)
+
+        await asyncio.gather(*(warm_node(k, m) for k, m in per_node.items()))
+
+    async def tick(self) -> None:
+        for device_key in OLLAMA_ENDPOINTS:
+            if not router.is_available(device_key):
+                continue
+            await router.refresh_loaded(device_key, force=True)
+            node = router.nodes[device_key]
+            loaded = set(node["loaded"])
+
+            for model_name in list(node["usage"]):
+                if self.is_hot(device_key, model_name) and model_name not in loaded:
+                    await self._load(device_key, model_name)
+
+    async def run(self) -> None:
+        await self.warm_up()
+        while True:
+            await asyncio.sleep(SCHEDULER_INTERVAL)
             try:
-                response = await client.get(f"{device['url']}/api/tags")
-                if response.status_code == 200:
-                    data = response.json()
-                    models = data.get("models", [])
-                    result.append(f"\n## {device['name']} ({device_key})")
-                    for m in models:
-                        size_gb = m.get("size", 0) / (1024**3)
-                        params = m.get("details", {}).get("parameter_size", "?")
-                        result.append(f"  - {m['name']} ({params}, {size_gb:.1f} GB)")
+                await self.tick()
             except Exception as e:
-                result.append(f"\n## {device['name']} ({device_key})")
-                result.append(f"  - Connection error: {str(e)}")
+                self.actions.append({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "action": "tick", "error": str(e)})
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+        self.task = None
+
+    def status(self) -> dict:
+        return {
+            "running": self.task is not None and not self.task.done(),
+            "keepAlive": {key: device["keep_alive"] for key, device in OLLAMA_ENDPOINTS.items()},
+            "hot": [
+                {"node": key, "model": model_name, "score": round(router.usage_score(key, model_name), 2)}
+                for key, node in router.nodes.items()
+                for model_name in node["usage"]
+                if self.is_hot(key, model_name)
+            ],
+            "actions": list(self.actions),
+        }
+
+
+model_scheduler = ModelScheduler()
+
+
+class ResponseCache:
+    """
+    TTL + LRU cache of model responses keyed by the normalized request.
+
+    Entries live in an in-memory OrderedDict bounded by ``max_entries``.
+    With a ``directory`` each entry is also written as ``<key>.json`` so the
+    cache survives restarts. Disk reads refresh the file mtime, and the
+    oldest mtimes are evicted once ``max_disk_entries`` is exceeded.
+    """
 
-    return "\n".join(result) if result else "No models found"
+    def __init__(self, max_entries: int, ttl: float, directory: str = "", max_disk_entries: int = 0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.directory = directory
+        self.max_disk_entries = max_disk_entries
+        self.entries = OrderedDict()
+        self.counters = {"hits": 0, "diskHits": 0, "misses": 0, "stores": 0, "evictions": 0, "expired": 0}
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key_for(path: str, model: str, **request) -> str:
+        normalized = json.dumps({"path": path, "model": model, **request}, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key: str):
+        now = time.time()
+        entry = self.entries.get(key)
+        if entry is not None:
+            if entry["expiresAt"] > now:
+                self.entries.move_to_end(key)
+                self.counters["hits"] += 1
+                return entry["value"]
+            del self.entries[key]
+            self.counters["expired"] += 1
+
+        if self.directory:
+            path = self._disk_path(key)
+            try:
+                with open(path, encoding="utf-8") as f:
+                    entry = json.load(f)
+                if entry["expiresAt"] > now:
+                    os.utime(path)
+                    self._remember(key, entry)
+                    self.counters["diskHits"] += 1
+                    return entry["value"]
+                os.remove(path)
+                self.counters["expired"] += 1
+            except (OSError, ValueError, KeyError):
+                pass
+
+        self.counters["misses"] += 1
+        return None
+
+    def put(self, key: str, value) -> None:
+        entry = {"expiresAt": time.time() + self.ttl, "value": value}
+        self._remember(key, entry)
+        self.counters["stores"] += 1
+        if not self.directory:
+            return
+        path = self._disk_path(key)
+        # Write then rename so a concurrent reader never sees a partial entry
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+            self._evict_disk()
+        except OSError:
+            pass
+
+    def _remember(self, key: str, entry: dict) -> None:
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.counters["evictions"] += 1
+
+    def _disk_entries(self) -> list:
+        entries = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if item.name.endswith(".json"):
+                    try:
+                        entries.append((item.stat().st_mtime, item.path))
+                    except FileNotFoundError:
+                        continue
+        return entries
+
+    def _evict_disk(self) -> None:
+        entries = self._disk_entries()
+        excess = len(entries) - self.max_disk_entries
+        for _mtime, path in sorted(entries)[:max(excess, 0)]:
+            try:
+                os.remove(path)
+                self.counters["evictions"] += 1
+            except FileNotFoundError:
+                pass
+
+    def clear(self) -> None:
+        self.entries.clear()
+        if self.directory:
+            for _mtime, path in self._disk_entries():
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self) -> dict:
+        hits = self.counters["hits"] + self.counters["diskHits"]
+        lookups = hits + self.counters["misses"]
+        return {
+            **self.counters,
+            "hitRate": round(hits / lookups, 4) if lookups else 0.0,
+            "entries": len(self.entries),
+            "diskEntries": len(self._disk_entries()) if self.directory else None,
+            "maxEntries": self.max_entries,
+            "ttl": self.ttl,
+            "directory": self.directory or None,
+            "enabledByDefault": RESPONSE_CACHE_ENABLED,
+        }
+
+
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MAX_ENTRIES,
+    RESPONSE_CACHE_TTL,
+    RESPONSE_CACHE_DIR,
+    RESPONSE_CACHE_MAX_DISK_ENTRIES,
+)
+
+
+@contextmanager
+def file_lock(path: str):
+    """Exclusive advisory lock shared by every gateway process using ``path``."""
+    with open(path, "a+b") as f:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+class EmbeddingStore:
+    """
+    Persistent content-hash -> vector cache, one shard directory per model.
+
+    Each shard has ``meta.json`` (current dimensions) and an append-only
+    ``vectors-<dimensions>.bin`` of fixed-size records: the 32-byte SHA-256
+    of the text followed by its float32 vector (native byte order), read
+    through mmap. Several gateway processes share the directory: appends
+    take a file lock and derive row numbers from the file size, other
+    processes' rows are picked up by rescanning the file tail, and a read
+    is only trusted when the record's stored hash matches. Files are never
+    truncated except for a torn trailing record found under the lock.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.shards = {}
+        self.counters = {"hits": 0, "misses": 0, "stores": 0}
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _shard(self, model: str) -> dict:
+        shard = self.shards.get(model)
+        if shard is not None:
+            return shard
+
+        root = os.path.join(self.directory, model.replace("/", "_").replace(":", "_"))
+        os.makedirs(root, exist_ok=True)
+        shard = {
+            "root": root,
+            "meta": os.path.join(root, "meta.json"),
+            "lock": os.path.join(root, "lock"),
+            "dimensions": 0,
+            "path": None,
+            "rows": {},
+            "indexed": 0,
+            "mmap": None,
+            "mapped": 0,
+        }
+        self._use(shard, self._stored_dimensions(shard))
+        self.shards[model] = shard
+        return shard
+
+    @staticmethod
+    def _stored_dimensions(shard: dict) -> int:
+        try:
+            with open(shard["meta"], encoding="utf-8") as f:
+                return int(json.load(f)["dimensions"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+
+    def _use(self, shard: dict, dimensions: int) -> None:
+        """Point the shard at the record file for ``dimensions`` and index it."""
+        if shard["mmap"] is not None:
+            shard["mmap"].close()
+        shard.update(
+            dimensions=dimensions,
+            path=os.path.join(shard["root"], f"vectors-{dimensions}.bin") if dimensions else None,
+            rows={},
+            indexed=0,
+            mmap=None,
+            mapped=0,
+        )
+        self._refresh(shard)
+
+    def _map(self, shard: dict) -> None:
+        """(Re)map the record file so rows appended since the last map are visible."""
+        if shard["mmap"] is not None:
+            shard["mmap"].close()
+            shard["mmap"] = None
+        shard["mapped"] = 0
+        try:
+            with open(shard["path"], "rb") as f:
+                shard["mmap"] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # missing or empty file
+            return
+        shard["mapped"] = len(shard["mmap"]) // (32 + 4 * shard["dimensions"])
+
+    def _refresh(self, shard: dict) -> None:
+        """Index complete records appended (by any process) since the last scan."""
+        if not shard["dimensions"]:
+            return
+        record = 32 + 4 * shard["dimensions"]
+        try:
+            complete = os.path.getsize(shard["path"]) // record
+        except OSError:
+            return
+        if complete <= shard["indexed"]:
+            return
+        if complete > shard["mapped"]:
+            self._map(shard)
+        view = shard["mmap"]
+        for row in range(shard["indexed"], min(complete, shard["mapped"])):
+            shard["rows"].setdefault(view[row * record:row * record + 32].hex(), row)
+        shard["indexed"] = min(complete, shard["mapped"])
+
+    def _vector(self, shard: dict, row: int, h: str) -> list[float] | None:
+        record = 32 + 4 * shard["dimensions"]
+        if row >= shard["mapped"]:
+            self._map(shard)
+            if row >= shard["mapped"]:
+                return None
+        offset = row * record
+        if shard["mmap"][offset:offset + 32].hex() != h:
+            return None
+        return memoryview(shard["mmap"])[offset + 32:offset + record].cast("f").tolist()
+
+    def lookup(self, model: str, hashes: list[str]) -> dict:
+        """Return {hash: vector} for every hash already stored for ``model``."""
+        shard = self._shard(model)
+        wanted = set(hashes)
+        if not wanted.issubset(shard["rows"]):
+            # Another process may have written the first records or switched dimensions
+            stored = self._stored_dimensions(shard)
+            if stored and stored != shard["dimensions"]:
+                self._use(shard, stored)
+            else:
+                self._refresh(shard)
+        found = {}
+        for h in wanted:
+            row = shard["rows"].get(h)
+            if row is None:
+                continue
+            vector = self._vector(shard, row, h)
+            if vector is None:
+                del shard["rows"][h]
+            else:
+                found[h] = vector
+        self.counters["hits"] += len(found)
+        self.counters["misses"] += len(wanted) - len(found)
+        return found
+
+    def add(self, model: str, items: dict) -> None:
+        """Append {hash: vector} entries that are not stored yet."""
+        shard = self._shard(model)
+        items = {h: v for h, v in items.items() if h not in shard["rows"]}
+        if not items:
+            return
+        dimensions = len(next(iter(items.values())))
+
+        with file_lock(shard["lock"]):
+            stored = self._stored_dimensions(shard)
+            if dimensions != stored:
+                # New model output size: switch files; old records stay for readers still on them
+                tmp = f"{shard['meta']}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    json.dump({"dimensions": dimensions}, f)
+                os.replace(tmp, shard["meta"])
+            if dimensions != shard["dimensions"]:
+                self._use(shard, dimensions)
+            else:
+                self._refresh(shard)
+            items = {h: v for h, v in items.items() if h not in shard["rows"] and len(v) == dimensions}
+            if not items:
+                return
+
+            record = 32 + 4 * dimensions
+            packed = bytearray()
+            for h, vector in items.items():
+                packed += bytes.fromhex(h)
+                packed += array("f", vector).tobytes()
+            with open(shard["path"], "ab") as f:
+                size = f.seek(0, os.SEEK_END)
+                if size % record:
+                    # A writer died mid-record; only the torn tail is dropped
+                    size -= size % record
+                    f.truncate(size)
+                f.write(packed)
+
+            base = size // record
+            if shard["indexed"] == base:
+                shard["indexed"] = base + len(items)
+            for offset, h in enumerate(items):
+                shard["rows"][h] = base + offset
+        self.counters["stores"] += len(items)
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "directory": self.directory,
+            "models": {model: len(shard["rows"]) for model, shard in self.shards.items()},
+        }
+
+
+embedding_store = EmbeddingStore(EMBED_CACHE_DIR) if EMBED_CACHE_ENABLED else None
+
+
+def should_cache(cache, temperature: float) -> bool:
+    """Explicit per-call choice wins; otherwise cache deterministic requests when enabled."""
+    if cache is None:
+        return RESPONSE_CACHE_ENABLED and temperature == 0
+    return bool(cache)
+
+
+def served_primary(decision: dict) -> bool:
+    """True if the primary route answered (failover answers are not cached under its key)."""
+    served, primary = decision["served"], decision["primary"]
+    return served["node"] == primary["node"] and served["model"] == primary["model"]
+
+
+def route_label(decision: dict) -> str:
+    """Header suffix noting when a request was served away from its primary route."""
+    if served_primary(decision):
+        return ""
+    primary = decision["primary"]
+    return f" - rerouted from {OLLAMA_ENDPOINTS[primary['node']]['name']} / {primary['model']}"
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate from character count (no tokenizer round-trip)."""
+    return int(len(text) / CHARS_PER_TOKEN) + 1 if text else 0
+
+
+def estimate_messages(messages: list[dict]) -> int:
+    return sum(estimate_tokens(m["content"]) + MESSAGE_OVERHEAD for m in messages)
+
+
+def context_window(device_key: str, model_name: str) -> int:
+    """num_ctx for a model on a node: the node's configured size, capped by the model's window."""
+    return min(OLLAMA_ENDPOINTS[device_key]["num_ctx"], MODEL_CONTEXT.get(model_name, DEFAULT_CONTEXT))
+
+
+def prompt_budget(device_key: str, model_name: str) -> int:
+    """Prompt tokens a model accepts on a node while leaving RESPONSE_RESERVE for the reply."""
+    return max(context_window(device_key, model_name) - RESPONSE_RESERVE, 256)
+
+
+def truncate_middle(text: str, max_tokens: int) -> str:
+    """Keep the head and tail of text (instructions and question usually live there), dropping the middle."""
+    max_chars = int(max_tokens * CHARS_PER_TOKEN)
+    if len(text) <= max_chars:
+        return text
+    dropped = len(text) - max_chars
+    marker = f"\n\n[... ~{int(dropped / CHARS_PER_TOKEN)} tokens truncated ...]\n\n"
+    keep = max(max_chars - len(marker), 0)
+    head = keep // 2
+    return text[:head] + marker + text[len(text) - (keep - head):]
+
+
+def fit_messages(messages: list[dict], device_key: str, model_name: str) -> tuple[list[dict], int]:
+    """
+    Trim messages to the model's prompt budget on a node, longest message first.
+    Returns the fitted messages and the estimated number of tokens dropped.
+    """
+    needed = estimate_messages(messages)
+    excess = needed - prompt_budget(device_key, model_name)
+    if excess <= 0:
+        return messages, 0
+
+    fitted = [dict(m) for m in messages]
+    for m in sorted(fitted, key=lambda m: len(m["content"]), reverse=True):
+        if excess <= 0:
+            break
+        tokens = estimate_tokens(m["content"])
+        m["content"] = truncate_middle(m["content"], max(tokens - excess, 0))
+        excess -= tokens - estimate_tokens(m["content"])
+    return fitted, needed - estimate_messages(fitted)
+
+
+def context_options(options: dict, device_key: str, model_name: str) -> dict:
+    """
+    Pin num_ctx to the node's fixed size on every call (and at warm-up).
+    Ollama allocates the KV cache for the full num_ctx and reloads a model
+    whenever it changes, so it is sized for the node's memory rather than
+    the model's maximum and never varies between requests.
+    """
+    return {**options, "num_ctx": context_window(device_key, model_name)}
+
+
+def split_task(prompt: str) -> tuple[str, str]:
+    """Split a long prompt into (document, question), taking a short closing or opening paragraph as the question."""
+    document, _, tail = prompt.rstrip().rpartition("\n\n")
+    if document and estimate_tokens(tail) <= MAP_REDUCE_TASK_TOKENS:
+        return document, tail.strip()
+    head, _, document = prompt.lstrip().partition("\n\n")
+    if document and estimate_tokens(head) <= MAP_REDUCE_TASK_TOKENS:
+        return document, head.strip()
+    return prompt, ""
 
 
 @mcp.tool()
+@instrumented
+async def list_models(timeout: float = 10.0, ctx: Context = None) -> str:
+    """
+    Lists all available models across the AI-Hub network.
+    Shows which models are running on HP and Pi devices.
+    All nodes are queried concurrently; each section reports its latency.
+
+    Args:
+        timeout: Per-node timeout in seconds (default 10)
+    """
+    result = []
+    started = time.perf_counter()
+    jobs = {key: fetch_tags(key) for key in OLLAMA_ENDPOINTS}
+
+    async for device_key, data, error, seconds in fan_out(jobs, timeout, ctx):
+        device = OLLAMA_ENDPOINTS[device_key]
+        section = [f"\n## {device['name']} ({device_key}) - {seconds:.2f}s"]
+        if isinstance(error, httpx.TransportError):
+            router.record_failure(device_key, error)
+        elif error is None:
+            router.record_success(device_key)
+        if error is None:
+            for m in data.get("models", []):
+                size_gb = m.get("size", 0) / (1024**3)
+                params = m.get("details", {}).get("parameter_size", "?")
+                section.append(f"  - {m['name']} ({params}, {size_gb:.1f} GB)")
+        else:
+            section.append(f"  - Connection error: {str(error)}")
+        result.extend(section)
+        await notify(ctx, "\n".join(section))
+
+    if not result:
+        return "No models found"
+    result.append(f"\nWall clock: {time.perf_counter() - started:.2f}s")
+    return "\n".join(result)
+
+
+@mcp.tool()
+@instrumented
 async def chat(
     prompt: str,
     model: str = "smart",
     system_prompt: str = "",
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    stream: bool = True,
+    cache: bool | None = None,
+    priority: str = "normal",
+    overflow: str = "truncate",
+    ctx: Context = None
 ) -> str:
     """
     Send a chat request to an Ollama model in the AI-Hub network.
@@ -105,69 +1596,214 @@ async def chat(
                - "medical" or "bio": BioMistral on Pi (medical queries)
                - "smart" or "balanced": Qwen 14B on HP (default, balanced)
                - "genius" or "heavy": Qwen 32B on HP (complex reasoning)
+               The request goes to the best available replica and fails
+               over to an equivalent model if a node is down (see
+               routing_status).
         system_prompt: Optional system instructions
         temperature: Creativity level (0.0-1.0, default 0.7)
+        stream: Stream tokens from Ollama, forwarding partial output and
+                reporting time-to-first-token and tokens/sec as notifications
+                (the returned text is unchanged). Cancelling the request
+                stops generation on the node.
+        cache: Reuse a cached answer for an identical request. Defaults to
+               caching temperature-0 requests when AIHUB_RESPONSE_CACHE is set.
+        priority: Queue priority on a busy node: "high", "normal" or "low".
+                  Identical concurrent requests share one generation.
+        overflow: What to do when the prompt exceeds the model's context
+                  budget (estimated at ~4 characters per token):
+                  - "truncate": drop the middle of the longest message (default)
+                  - "map_reduce": read the prompt in chunks, then answer from
+                    per-chunk notes (a short closing or opening paragraph
+                    is taken as the question)
+                  - "error": reject before spending any prefill time
 
     Returns:
-        The model's response text
+        The model's response text, or "Busy: ..." if every node shed it
     """
-    # Resolve model route
-    model_lower = model.lower()
-
-    if model_lower in MODEL_ROUTES:
-        device_key, model_name = MODEL_ROUTES[model_lower]
-    else:
-        # Try to find direct model match
-        for dk, device in OLLAMA_ENDPOINTS.items():
-            if model_lower in [m.lower() for m in device["models"]]:
-                device_key = dk
-                model_name = model
-                break
-        else:
-            # Default to smart
-            device_key, model_name = MODEL_ROUTES["smart"]
-
-    endpoint = OLLAMA_ENDPOINTS[device_key]
-
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.append({"role": "user", "content": prompt})
-
-    payload = {
-        "model": model_name,
-        "messages": messages,
-        "stream": False,
-        "options": {
-            "temperature": temperature
-        }
-    }
-
-    async with httpx.AsyncClient(timeout=300.0) as client:
+    options = {"temperature": temperature}
+    priority_level = PRIORITIES.get(priority.lower(), 1)
+
+    overflow = overflow.lower()
+    if overflow not in OVERFLOW_MODES:
+        return f"Error: overflow must be one of: {', '.join(OVERFLOW_MODES)}"
+    primary_node, primary_model = resolve_route(model)
+    needed, budget = estimate_messages(messages), prompt_budget(primary_node, primary_model)
+    oversized = needed > budget
+    if oversized and overflow == "error":
+        metrics.inc("aihub_prompt_overflow_total", {"model": primary_model, "action": "rejected"})
+        return (
+            f"Error: Prompt is ~{needed} tokens but {primary_model} accepts ~{budget} "
+            f"({context_window(primary_node, primary_model)} context minus {RESPONSE_RESERVE} reserved for the reply). "
+            'Shorten it or use overflow="truncate" or "map_reduce".'
+        )
+
+    request_key = ResponseCache.key_for(
+        "/api/chat",
+        primary_model,
+        messages=[{"role": m["role"], "content": m["content"].strip()} for m in messages],
+        options=options,
+        **({"overflow": overflow} if oversized else {}),
+    )
+    use_cache = should_cache(cache, temperature)
+    if use_cache:
+        cached = response_cache.get(request_key)
+        if cached is not None:
+            return f"[{OLLAMA_ENDPOINTS[cached['node']]['name']} / {cached['model']} - cached]\n\n{cached['content']}"
+
+    def requester(messages):
+        async def request(device_key, model_name):
+            # Budget per attempt: a failover target may have a smaller window
+            fitted, dropped = fit_messages(messages, device_key, model_name)
+            if dropped:
+                metrics.inc("aihub_prompt_overflow_total", {"model": model_name, "action": "truncate"})
+            if stream:
+                content, stats = await stream_ollama(device_key, "/api/chat", {
+                    "model": model_name,
+                    "messages": fitted,
+                    "options": context_options(options, device_key, model_name),
+                    "keep_alive": model_scheduler.keep_alive_for(device_key, model_name)
+                }, 300.0, ctx)
+                await notify(ctx, f"{model_name}: {format_stream_stats(stats)}")
+                return content, dropped
+            return await ollama_chat(device_key, model_name, fitted, options), dropped
+        return request
+
+    async def routed():
+        final, note = messages, ""
+        if oversized and overflow == "map_reduce":
+            final, parts = await map_reduce_messages(prompt, system_prompt, model, priority_level, ctx)
+            note = f" - map-reduce over {parts} parts"
+        decision = await router.plan(model)
         try:
-            response = await client.post(
-                f"{endpoint['url']}/api/chat",
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            content = data.get("message", {}).get("content", "")
-            device_name = endpoint["name"]
-
-            return f"[{device_name} / {model_name}]\n\n{content}"
-
-        except httpx.TimeoutException:
-            return f"Error: Request timed out for {model_name} on {endpoint['name']}"
+            return decision, note, await router.call(decision, requester(final), priority_level)
         except Exception as e:
-            return f"Error: {str(e)}"
+            e.decision = decision
+            raise
+
+    try:
+        # Only the leader's client receives streamed notifications; never share a run across modes
+        decision, note, (device_key, model_name, (content, dropped)) = await coalesce(
+            f"{request_key}:stream={stream}", routed
+        )
+        if dropped:
+            note += f" - truncated ~{dropped} tokens"
+        header = f"[{OLLAMA_ENDPOINTS[device_key]['name']} / {model_name}{route_label(decision)}{note}]"
+        if use_cache and served_primary(decision):
+            response_cache.put(request_key, {"node": device_key, "model": model_name, "content": content})
+
+        return f"{header}\n\n{content}"
+
+    except NodeBusy as e:
+        return f"Busy: {str(e)}. Retry later or choose another model."
+    except httpx.TimeoutException as e:
+        attempts = getattr(e, "decision", {}).get("attempts")
+        if not attempts:
+            return f"Error: Request timed out ({str(e)})"
+        return f"Error: Request timed out for {attempts[-1]['model']} on {OLLAMA_ENDPOINTS[attempts[-1]['node']]['name']}"
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+async def ollama_chat(device_key: str, model_name: str, messages: list[dict], options: dict) -> str:
+    """Non-streaming /api/chat call on one node; returns the reply text."""
+    response = await get_client(device_key).post(
+        "/api/chat",
+        json={
+            "model": model_name,
+            "messages": messages,
+            "stream": False,
+            "options": context_options(options, device_key, model_name),
+            "keep_alive": model_scheduler.keep_alive_for(device_key, model_name)
+        },
+        timeout=request_timeout(300.0)
+    )
+    response.raise_for_status()
+    data = response.json()
+
+    metrics.observe_generation(device_key, model_name, data)
+    return data.get("message", {}).get("content", "")
+
+
+async def map_reduce_messages(
+    prompt: str,
+    system_prompt: str,
+    model: str,
+    priority: int,
+    ctx: Context = None
+) -> tuple[list[dict], int]:
+    """
+    Map step for a prompt too long for the model: split the document into
+    chunks that fit the budget, extract what each chunk contributes to the
+    request, and return the reduce-step messages built from those notes
+    together with the number of parts read.
+    """
+    device_key, model_name = resolve_route(model)
+    document, task = split_task(prompt)
+    request_text = task or "Summarize the key content of this part."
+    instructions = (
+        "You are reading one part of a document too long to read at once. "
+        "Extract everything in this part that helps with the request, quoting names and figures exactly. "
+        'Reply "Nothing relevant." if nothing does.'
+    )
+    overhead = estimate_tokens(instructions) + estimate_tokens(request_text) + 3 * MESSAGE_OVERHEAD + 16
+    chunk_chars = int(max(prompt_budget(device_key, model_name) - overhead, 256) * CHARS_PER_TOKEN)
+    chunks = chunk_document(document, chunk_chars, RAG_CHUNK_OVERLAP)
+    if len(chunks) > MAP_REDUCE_MAX_CHUNKS:
+        # Bound the fan-out: keep the opening and closing parts
+        head = MAP_REDUCE_MAX_CHUNKS // 2
+        chunks = chunks[:head] + chunks[len(chunks) - (MAP_REDUCE_MAX_CHUNKS - head):]
+    metrics.inc("aihub_prompt_overflow_total", {"model": model_name, "action": "map_reduce"})
+
+    semaphore = asyncio.Semaphore(MAP_REDUCE_CONCURRENCY)
+    done = 0
+
+    async def map_chunk(index, chunk):
+        nonlocal done
+        messages = [
+            {"role": "system", "content": instructions},
+            {"role": "user", "content": f"Request: {request_text}\n\nPart {index + 1} of {len(chunks)}:\n\n{chunk}"},
+        ]
+
+        async def request(device_key, model_name):
+            fitted, _ = fit_messages(messages, device_key, model_name)
+            return await ollama_chat(device_key, model_name, fitted, {"temperature": 0})
+
+        async with semaphore:
+            decision = await router.plan(model)
+            _, _, notes = await router.call(decision, request, priority)
+        done += 1
+        await notify(ctx, f"Map-reduce: read part {done}/{len(chunks)}")
+        return notes.strip()
+
+    notes = await asyncio.gather(*(map_chunk(i, chunk) for i, chunk in enumerate(chunks)))
+    combined = "\n\n".join(f"[Part {i + 1}]\n{note}" for i, note in enumerate(notes))
+    reduce = []
+    if system_prompt:
+        reduce.append({"role": "system", "content": system_prompt})
+    reduce.append({
+        "role": "user",
+        "content": (
+            f"Notes extracted from each part of a long document:\n\n{combined}\n\n"
+            f"{task or 'Using these notes, write a single summary of the whole document.'}"
+        ),
+    })
+    return reduce, len(chunks)
 
 
 @mcp.tool()
+@instrumented
 async def generate(
     prompt: str,
     model: str = "smart",
-    temperature: float = 0.7
+    temperature: float = 0.7,
+    stream: bool = True,
+    cache: bool | None = None,
+    priority: str = "normal",
+    ctx: Context = None
 ) -> str:
     """
     Generate text completion (non-chat format) from an Ollama model.
@@ -176,21 +1812,20 @@ async def generate(
         prompt: The prompt text for completion
         model: Model alias (fast, smart, genius, medical) or model name
         temperature: Creativity level (0.0-1.0)
+        stream: Stream tokens, forwarding partial output and reporting
+                TTFT and tokens/sec as notifications (the returned text is
+                unchanged). Cancelling the request stops generation.
+        cache: Reuse a cached completion for an identical request. Defaults
+               to caching temperature-0 requests when AIHUB_RESPONSE_CACHE is set.
+        priority: Queue priority on a busy node: "high", "normal" or "low"
+
+    Prompts longer than the model's context budget are truncated in the
+    middle (see chat's overflow option for alternatives).
 
     Returns:
         Generated text completion
     """
-    model_lower = model.lower()
-
-    if model_lower in MODEL_ROUTES:
-        device_key, model_name = MODEL_ROUTES[model_lower]
-    else:
-        device_key, model_name = MODEL_ROUTES["smart"]
-
-    endpoint = OLLAMA_ENDPOINTS[device_key]
-
     payload = {
-        "model": model_name,
         "prompt": prompt,
         "stream": False,
         "options": {
@@ -198,25 +1833,63 @@ async def generate(
         }
     }
 
-    async with httpx.AsyncClient(timeout=300.0) as client:
-        try:
-            response = await client.post(
-                f"{endpoint['url']}/api/generate",
-                json=payload
-            )
-            response.raise_for_status()
-            data = response.json()
-
-            return data.get("response", "")
-
-        except Exception as e:
-            return f"Error: {str(e)}"
+    async def request(device_key, model_name):
+        budgeted = truncate_middle(prompt, prompt_budget(device_key, model_name))
+        if budgeted is not prompt:
+            metrics.inc("aihub_prompt_overflow_total", {"model": model_name, "action": "truncate"})
+        body = {
+            **payload,
+            "prompt": budgeted,
+            "options": context_options(payload["options"], device_key, model_name),
+            "model": model_name,
+            "keep_alive": model_scheduler.keep_alive_for(device_key, model_name)
+        }
+        if stream:
+            text, stats = await stream_ollama(device_key, "/api/generate", body, 300.0, ctx)
+            await notify(ctx, f"{model_name}: {format_stream_stats(stats)}")
+            return text
+
+        response = await get_client(device_key).post("/api/generate", json=body, timeout=request_timeout(300.0))
+        response.raise_for_status()
+        data = response.json()
+
+        metrics.observe_generation(device_key, model_name, data)
+        return data.get("response", "")
+
+    request_key = ResponseCache.key_for(
+        "/api/generate",
+        resolve_route(model)[1],
+        prompt=prompt.strip(),
+        options=payload["options"],
+    )
+    use_cache = should_cache(cache, temperature)
+    if use_cache:
+        cached = response_cache.get(request_key)
+        if cached is not None:
+            return cached
+
+    async def routed():
+        decision = await router.plan(model)
+        return decision, await router.call(decision, request, PRIORITIES.get(priority.lower(), 1))
+
+    try:
+        decision, (_, _, text) = await coalesce(f"{request_key}:stream={stream}", routed)
+        if use_cache and served_primary(decision):
+            response_cache.put(request_key, text)
+        return text
+
+    except NodeBusy as e:
+        return f"Busy: {str(e)}. Retry later or choose another model."
+    except Exception as e:
+        return f"Error: {str(e)}"
 
 
 @mcp.tool()
+@instrumented
 async def embed(text: str) -> str:
     """
     Generate embeddings for text using nomic-embed-text model on Pi.
+    Returns a preview only; use embed_batch for full vectors and bulk input.
 
     Args:
         text: The text to embed
@@ -224,114 +1897,387 @@ async def embed(text: str) -> str:
     Returns:
         JSON string of embedding vector (for use in vector databases)
     """
-    endpoint = OLLAMA_ENDPOINTS["pi"]
-
-    payload = {
-        "model": "nomic-embed-text:latest",
-        "input": text
-    }
-
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        try:
-            response = await client.post(
-                f"{endpoint['url']}/api/embed",
-                json=payload
+    try:
+        _, vectors, _, cached = await embed_texts([text], "embed")
+
+        embeddings = vectors[0]
+        return json.dumps({
+            "model": "nomic-embed-text",
+            "dimensions": len(embeddings),
+            "embedding": embeddings[:10],  # Show first 10 for preview
+            "full_length": len(embeddings),
+            "cached": bool(cached)
+        })
+
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+
+def chunk_texts(texts: list[str], batch_size: int, max_chars: int) -> list[tuple[int, list[str]]]:
+    """Split texts into (start_index, batch) pairs bounded by count and total characters."""
+    batches = []
+    start, current, chars = 0, [], 0
+    for index, text in enumerate(texts):
+        if current and (len(current) >= batch_size or chars + len(text) > max_chars):
+            batches.append((start, current))
+            start, current, chars = index, [], 0
+        current.append(text)
+        chars += len(text)
+    if current:
+        batches.append((start, current))
+    return batches
+
+
+def encode_vector(vector: list[float]) -> str:
+    """Base64 of the vector as little-endian float32 (numpy: frombuffer(..., "<f4"))."""
+    packed = array("f", vector)
+    if sys.byteorder == "big":
+        packed.byteswap()
+    return base64.b64encode(packed.tobytes()).decode("ascii")
+
+
+async def embed_texts(
+    texts: list[str],
+    model: str = "embed",
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_chars: int = EMBED_BATCH_MAX_CHARS,
+    use_cache: bool = True
+) -> tuple[str, list[list[float]], int, int]:
+    """
+    Embed many texts with as few /api/embed round trips as possible.
+    Vectors already in the embedding store are reused; only distinct
+    misses go to the model, up to EMBED_CONCURRENCY batches at a time.
+    Returns (model_name, vectors in input order, batch_count, cached_count).
+    """
+    served_model = resolve_route(model)[1]
+    hashes = [EmbeddingStore.hash_text(text) for text in texts]
+    store = embedding_store if use_cache else None
+    known = store.lookup(served_model, hashes) if store is not None else {}
+
+    pending = {}
+    for h, text in zip(hashes, texts):
+        if h not in known:
+            pending.setdefault(h, text)
+    pending_hashes = list(pending)
+
+    batches = chunk_texts(list(pending.values()), max(1, batch_size), max(1, max_chars))
+    fresh = {}
+    semaphore = asyncio.Semaphore(max(1, EMBED_CONCURRENCY))
+
+    async def run(start, batch):
+        nonlocal served_model
+
+        async def request(device_key, model_name):
+            response = await get_client(device_key).post(
+                "/api/embed",
+                json={
+                    "model": model_name,
+                    "input": batch,
+                    "keep_alive": model_scheduler.keep_alive_for(device_key, model_name)
+                },
+                timeout=request_timeout(120.0)
             )
             response.raise_for_status()
-            data = response.json()
+            return response.json()
+
+        async with semaphore:
+            # Bulk embedding yields to interactive requests on a busy node
+            priority = PRIORITIES["low"] if len(batches) > 1 else PRIORITIES["normal"]
+            _, served_model, data = await router.call(await router.plan(model), request, priority)
+        embeddings = data.get("embeddings", [])
+        if len(embeddings) != len(batch):
+            raise RuntimeError(f"expected {len(batch)} embeddings, got {len(embeddings)}")
+        for h, vector in zip(pending_hashes[start:start + len(batch)], embeddings):
+            fresh[h] = vector
+
+    await asyncio.gather(*(run(start, batch) for start, batch in batches))
+    if store is not None and fresh:
+        store.add(served_model, fresh)
+
+    vectors = [known[h] if h in known else fresh[h] for h in hashes]
+    cached = sum(1 for h in hashes if h in known)
+    metrics.inc("aihub_embed_inputs_total", {"source": "cache"}, cached)
+    metrics.inc("aihub_embed_inputs_total", {"source": "model"}, len(texts) - cached)
+    return served_model, vectors, len(batches), cached
+
+
+def write_embeddings(path: str, vectors: list[list[float]]) -> str:
+    """
+    Write vectors to ``path``: JSON Lines for *.jsonl, otherwise a raw
+    little-endian float32 matrix (count x dimensions). Returns the format.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    if path.endswith(".jsonl"):
+        with open(path, "w", encoding="utf-8") as f:
+            for index, vector in enumerate(vectors):
+                f.write(json.dumps({"index": index, "embedding": vector}) + "\n")
+        return "jsonl"
+
+    with open(path, "wb") as f:
+        for vector in vectors:
+            packed = array("f", vector)
+            if sys.byteorder == "big":
+                packed.byteswap()
+            f.write(packed.tobytes())
+    return "float32-le"
 
-            embeddings = data.get("embeddings", [[]])[0]
-            return json.dumps({
-                "model": "nomic-embed-text",
-                "dimensions": len(embeddings),
-                "embedding": embeddings[:10],  # Show first 10 for preview
-                "full_length": len(embeddings)
-            })
 
-        except Exception as e:
-            return f"Error: {str(e)}"
+@mcp.tool()
+@instrumented
+async def embed_batch(
+    texts: list[str],
+    model: str = "embed",
+    batch_size: int = EMBED_BATCH_SIZE,
+    max_batch_chars: int = EMBED_BATCH_MAX_CHARS,
+    encoding: str = "base64",
+    output_path: str = "",
+    use_cache: bool = True
+) -> str:
+    """
+    Generate full embedding vectors for many texts at once.
+    Inputs are packed into as few /api/embed calls as possible, chunked by
+    count and total characters. Previously embedded texts are served from
+    the persistent embedding cache.
+
+    Args:
+        texts: The texts to embed
+        model: Embedding model alias or name (default: nomic-embed-text)
+        batch_size: Maximum inputs per request
+        max_batch_chars: Maximum total characters per request
+        encoding: "base64" (little-endian float32 per vector) or "json" (lists)
+        output_path: Optional local file to write the vectors to instead of
+                     returning them (*.jsonl, or anything else for a raw
+                     float32 count x dimensions matrix)
+        use_cache: Reuse and store vectors in the embedding cache
+
+    Returns:
+        JSON with model, dimensions, count, fromCache/fromModel and
+        embeddings (or the file path)
+    """
+    if not texts:
+        return "Error: no texts given"
+    if encoding not in ("base64", "json"):
+        return f"Error: unknown encoding {encoding!r} (use base64 or json)"
+
+    started = time.perf_counter()
+    try:
+        model_name, vectors, batch_count, cached = await embed_texts(
+            texts, model, batch_size, max_batch_chars, use_cache
+        )
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+    result = {
+        "model": model_name,
+        "dimensions": len(vectors[0]) if vectors else 0,
+        "count": len(vectors),
+        "fromCache": cached,
+        "fromModel": len(vectors) - cached,
+        "batches": batch_count,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    if output_path:
+        try:
+            result["format"] = write_embeddings(output_path, vectors)
+        except OSError as e:
+            return f"Error writing {output_path}: {str(e)}"
+        result["output_path"] = os.path.abspath(output_path)
+    elif encoding == "base64":
+        result["encoding"] = "base64-float32-le"
+        result["embeddings"] = [encode_vector(v) for v in vectors]
+    else:
+        result["encoding"] = "json"
+        result["embeddings"] = vectors
+    return json.dumps(result)
 
 
 @mcp.tool()
-async def compare_models(prompt: str, models: str = "fast,smart") -> str:
+@instrumented
+async def compare_models(
+    prompt: str,
+    models: str = "fast,smart",
+    timeout: float = 300.0,
+    ctx: Context = None
+) -> str:
     """
     Compare responses from multiple models for the same prompt.
     Useful for evaluating which model works best for a specific task.
+    Models run concurrently; answers are listed in the order they arrive.
 
     Args:
         prompt: The question/prompt to send to all models
         models: Comma-separated list of model aliases (e.g., "fast,smart,genius")
+        timeout: Per-model timeout in seconds (default 300)
 
     Returns:
-        Side-by-side comparison of responses
+        Side-by-side comparison of responses with per-model latency
     """
     model_list = [m.strip().lower() for m in models.split(",")]
     results = []
-
-    for model_alias in model_list:
+    started = time.perf_counter()
+    messages = [{"role": "user", "content": prompt}]
+
+    async def answer(model_alias):
+        # Routed directly rather than through the chat tool, so a comparison
+        # is not also counted as N chat calls in the tool metrics
+        async def request(device_key, model_name):
+            fitted, _ = fit_messages(messages, device_key, model_name)
+            return await ollama_chat(device_key, model_name, fitted, {"temperature": 0.7})
+
+        decision = await router.plan(model_alias)
+        device_key, model_name, content = await router.call(decision, request, PRIORITIES["normal"])
+        return f"[{OLLAMA_ENDPOINTS[device_key]['name']} / {model_name}{route_label(decision)}]\n\n{content}"
+
+    jobs = {}
+    for model_alias in dict.fromkeys(model_list):
         if model_alias in MODEL_ROUTES:
-            response = await chat(prompt=prompt, model=model_alias)
-            results.append(f"### {model_alias.upper()}\n{response}\n")
+            jobs[model_alias] = answer(model_alias)
         else:
             results.append(f"### {model_alias.upper()}\nUnknown model alias\n")
 
+    async for model_alias, response, error, seconds in fan_out(jobs, timeout, ctx):
+        if error is not None:
+            response = f"Error: {str(error)}"
+        entry = f"### {model_alias.upper()} ({seconds:.2f}s)\n{response}\n"
+        results.append(entry)
+        await notify(ctx, entry)
+
+    results.append(f"Wall clock: {time.perf_counter() - started:.2f}s")
     return "\n---\n".join(results)
 
 
 @mcp.tool()
-async def health_check() -> str:
+@instrumented
+async def health_check(timeout: float = 5.0, ctx: Context = None) -> str:
     """
     Check the health and connectivity of all AI-Hub devices.
     Shows which devices are online and their available models.
+    All nodes are probed concurrently; each line reports its latency.
+
+    Args:
+        timeout: Per-node timeout in seconds (default 5)
     """
     results = []
+    started = time.perf_counter()
+    jobs = {key: fetch_tags(key) for key in OLLAMA_ENDPOINTS}
+
+    async for device_key, data, error, seconds in fan_out(jobs, timeout, ctx):
+        name = OLLAMA_ENDPOINTS[device_key]["name"]
+        if isinstance(error, httpx.TransportError):
+            router.record_failure(device_key, error)
+        elif error is None:
+            router.record_success(device_key)
+        if error is None:
+            status = f"ONLINE ({len(data.get('models', []))} models)"
+        elif isinstance(error, httpx.HTTPStatusError):
+            status = f"ERROR (HTTP {error.response.status_code})"
+        elif isinstance(error, httpx.ConnectError):
+            status = "OFFLINE (connection refused)"
+        elif isinstance(error, httpx.TimeoutException):
+            status = "TIMEOUT"
+        else:
+            status = f"ERROR ({str(error)})"
+        line = f"- {name}: {status} [{seconds * 1000:.0f} ms]"
+        results.append(line)
+        await notify(ctx, line)
 
-    async with httpx.AsyncClient(timeout=5.0) as client:
-        for device_key, device in OLLAMA_ENDPOINTS.items():
-            try:
-                response = await client.get(f"{device['url']}/api/tags")
-                if response.status_code == 200:
-                    data = response.json()
-                    model_count = len(data.get("models", []))
-                    results.append(f"- {device['name']}: ONLINE ({model_count} models)")
-                else:
-                    results.append(f"- {device['name']}: ERROR (HTTP {response.status_code})")
-            except httpx.ConnectError:
-                results.append(f"- {device['name']}: OFFLINE (connection refused)")
-            except httpx.TimeoutException:
-                results.append(f"- {device['name']}: TIMEOUT")
-            except Exception as e:
-                results.append(f"- {device['name']}: ERROR ({str(e)})")
-
+    results.append(f"\nWall clock: {(time.perf_counter() - started) * 1000:.0f} ms")
     return "## AI-Hub Health Status\n" + "\n".join(results)
 
 
 @mcp.tool()
+@instrumented
+async def routing_status(model: str = "") -> str:
+    """
+    Show the routing engine's view of the AI-Hub for debugging.
+    Includes per-node health, in-flight requests, EWMA latency, loaded
+    models and usage, admission queue depth and wait times, request
+    coalescing counts, warm-up activity and the most recent
+    routing decisions.
+
+    Args:
+        model: Optional alias or model name to dry-run a routing decision for
+
+    Returns:
+        JSON with "nodes", "queues", "coalescing", "scheduler",
+        "decisions" and, if requested, "plan"
+    """
+    status = router.status()
+    if model:
+        status["plan"] = await router.plan(model, record=False)
+    return json.dumps(status, indent=2)
+
+
+@mcp.tool()
+@instrumented
+async def cache_stats(clear: bool = False) -> str:
+    """
+    Show response cache statistics (hits, misses, hit rate, evictions)
+    and embedding cache counters.
+
+    Args:
+        clear: Drop every cached response (memory and disk) after reporting
+
+    Returns:
+        JSON with cache counters and configuration
+    """
+    stats = response_cache.stats()
+    stats["embeddings"] = embedding_store.stats() if embedding_store is not None else None
+    if clear:
+        response_cache.clear()
+        stats["cleared"] = True
+    return json.dumps(stats, indent=2)
+
+
+@mcp.tool(name="metrics")
+@instrumented
+async def metrics_report(format: str = "json") -> str:
+    """
+    Gateway performance metrics: per-tool and per-node request and error
+    counts, latency histograms, time-to-first-token, prompt/eval token
+    counts and tokens/sec. The same data is scraped by Prometheus from
+    /metrics.
+
+    Args:
+        format: "json" (with p50/p95/p99 per series) or "prometheus"
+
+    Returns:
+        Metrics in the requested format
+    """
+    if format == "prometheus":
+        return metrics.render()
+    return json.dumps(metrics.summary(), indent=2)
+
+
+@mcp.tool()
+@instrumented
 async def rag_workspaces() -> str:
     """
     List available RAG workspaces in AnythingLLM.
     Shows all document collections available for querying.
     """
-    async with httpx.AsyncClient(timeout=10.0) as client:
-        try:
-            response = await client.get(f"{ANYTHINGLLM_URL}/api/workspaces")
-            if response.status_code == 200:
-                data = response.json()
-                workspaces = data.get("workspaces", [])
-                result = ["## AnythingLLM Workspaces\n"]
-                for ws in workspaces:
-                    name = ws.get("name", "Unknown")
-                    slug = ws.get("slug", "")
-                    mode = ws.get("chatMode", "query")
-                    result.append(f"- **{name}** (slug: {slug}, mode: {mode})")
-                return "\n".join(result)
-            else:
-                return f"Error: HTTP {response.status_code}"
-        except Exception as e:
-            return f"Error connecting to AnythingLLM: {str(e)}"
+    client = get_client("anythingllm")
+    try:
+        response = await client.get("/api/workspaces", timeout=request_timeout(10.0))
+        if response.status_code == 200:
+            data = response.json()
+            workspaces = data.get("workspaces", [])
+            result = ["## AnythingLLM Workspaces\n"]
+            for ws in workspaces:
+                name = ws.get("name", "Unknown")
+                slug = ws.get("slug", "")
+                mode = ws.get("chatMode", "query")
+                result.append(f"- **{name}** (slug: {slug}, mode: {mode})")
+            return "\n".join(result)
+        else:
+            return f"Error: HTTP {response.status_code}"
+    except Exception as e:
+        return f"Error connecting to AnythingLLM: {str(e)}"
 
 
 @mcp.tool()
+@instrumented
 async def rag_query(
     query: str,
     workspace: str = "cf",
@@ -358,89 +2304,491 @@ async def rag_query(
         "mode": mode
     }
 
-    headers = {}
-    if ANYTHINGLLM_API_KEY:
-        headers["Authorization"] = f"Bearer {ANYTHINGLLM_API_KEY}"
+    client = get_client("anythingllm")
+    try:
+        response = await client.post(
+            f"/api/v1/workspace/{ws_slug}/chat",
+            json=payload,
+            timeout=request_timeout(120.0)
+        )
+        if response.status_code == 200:
+            data = response.json()
+            text_response = data.get("textResponse", "No response")
+            sources = data.get("sources", [])
+
+            result = f"## RAG Response ({ws_slug})\n\n{text_response}"
 
-    async with httpx.AsyncClient(timeout=120.0) as client:
+            if sources:
+                result += "\n\n### Sources:\n"
+                for src in sources[:5]:  # Limit to 5 sources
+                    title = src.get("title", "Unknown")
+                    result += f"- {title}\n"
+
+            return result
+        else:
+            return f"Error: HTTP {response.status_code} - {response.text}"
+    except Exception as e:
+        return f"Error querying RAG: {str(e)}"
+
+
+def chunk_document(text: str, size: int = RAG_CHUNK_CHARS, overlap: int = RAG_CHUNK_OVERLAP) -> list[str]:
+    """Split text into ~size-character chunks on paragraph boundaries, overlapping long runs."""
+    chunks = []
+    current = ""
+    for paragraph in (p.strip() for p in text.split("\n\n")):
+        if not paragraph:
+            continue
+        if current and len(current) + len(paragraph) + 2 > size:
+            chunks.append(current)
+            current = ""
+        while len(paragraph) > size:
+            chunks.append(paragraph[:size])
+            paragraph = paragraph[size - overlap:]
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class VectorIndex:
+    """
+    In-process cosine-similarity index over document chunks.
+
+    Vectors are L2-normalized at build time so a search is one
+    matrix-vector product plus a top-k selection. NumPy is used when
+    installed; otherwise a pure-Python scan over float32 arrays gives the
+    same results more slowly. Exact brute force is fast enough at
+    workspace scale (tens of thousands of chunks).
+    """
+
+    def __init__(self, chunks: list[dict], vectors: list, documents: dict | None = None, origin: str = ""):
+        self.chunks = chunks
+        self.documents = documents or {}  # source -> signature it was indexed at
+        self.origin = origin              # local path the documents came from ("" = AnythingLLM)
+        self.dimensions = len(vectors[0]) if len(vectors) else 0
+        if np is not None:
+            matrix = np.asarray(vectors, dtype=np.float32).reshape(len(chunks), self.dimensions)
+            norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+            self.matrix = matrix / np.maximum(norms, 1e-12)
+        else:
+            self.matrix = [self._normalize(v) for v in vectors]
+
+    @staticmethod
+    def _normalize(vector) -> array:
+        norm = sum(x * x for x in vector) ** 0.5 or 1e-12
+        return array("f", (x / norm for x in vector))
+
+    def search(self, vector: list[float], top_k: int) -> list[tuple[float, dict]]:
+        if not self.chunks:
+            return []
+        top_k = min(top_k, len(self.chunks))
+        if np is not None:
+            query = np.asarray(vector, dtype=np.float32)
+            scores = self.matrix @ (query / max(float(np.linalg.norm(query)), 1e-12))
+            best = np.argpartition(-scores, top_k - 1)[:top_k]
+            best = best[np.argsort(-scores[best])]
+            return [(float(scores[i]), self.chunks[i]) for i in best]
+
+        query = self._normalize(vector)
+        scored = (
+            (sum(a * b for a, b in zip(row, query)), i)
+            for i, row in enumerate(self.matrix)
+        )
+        return [(score, self.chunks[i]) for score, i in heapq.nlargest(top_k, scored)]
+
+    @staticmethod
+    def _digest(chunks_data: bytes, vectors_data: bytes) -> str:
+        h = hashlib.sha256(chunks_data)
+        h.update(b"\0")
+        h.update(vectors_data)
+        return h.hexdigest()[:16]
+
+    @staticmethod
+    def _write(path: str, data: bytes) -> None:
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def save(self, directory: str) -> None:
+        """
+        Persist the index for every gateway process sharing the directory.
+        Chunks and vectors go to files named by their content digest, and
+        meta.json, replaced last, names the generation to read, so a reader
+        never pairs new chunks with old vectors. The previous generation is
+        kept for readers that are still loading it.
+        """
+        os.makedirs(directory, exist_ok=True)
+        chunks_data = "".join(json.dumps(chunk) + "\n" for chunk in self.chunks).encode("utf-8")
+        packed = array("f")
+        for row in self.matrix:
+            packed.extend(row.tolist() if np is not None else row)
+        vectors_data = packed.tobytes()
+        digest = self._digest(chunks_data, vectors_data)
+
+        meta_path = os.path.join(directory, "meta.json")
         try:
-            response = await client.post(
-                f"{ANYTHINGLLM_URL}/api/v1/workspace/{ws_slug}/chat",
-                json=payload,
-                headers=headers
-            )
-            if response.status_code == 200:
-                data = response.json()
-                text_response = data.get("textResponse", "No response")
-                sources = data.get("sources", [])
+            with open(meta_path, encoding="utf-8") as f:
+                previous = json.load(f).get("digest")
+        except (OSError, ValueError):
+            previous = None
+        self._write(os.path.join(directory, f"chunks-{digest}.jsonl"), chunks_data)
+        self._write(os.path.join(directory, f"vectors-{digest}.f32"), vectors_data)
+        self._write(meta_path, json.dumps({
+            "digest": digest,
+            "dimensions": self.dimensions,
+            "count": len(self.chunks),
+            "built": time.time(),
+            "origin": self.origin,
+            "documents": self.documents,
+        }).encode("utf-8"))
+
+        for name in os.listdir(directory):
+            stem, _, rest = name.partition("-")
+            if stem in ("chunks", "vectors") and rest.split(".")[0] not in (digest, previous):
+                try:
+                    os.remove(os.path.join(directory, name))
+                except OSError:
+                    pass
+
+    @classmethod
+    def load(cls, directory: str):
+        """Load a saved index, or return None if there is none (or it fails verification)."""
+        try:
+            with open(os.path.join(directory, "meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+            digest = meta["digest"]
+            with open(os.path.join(directory, f"chunks-{digest}.jsonl"), "rb") as f:
+                chunks_data = f.read()
+            with open(os.path.join(directory, f"vectors-{digest}.f32"), "rb") as f:
+                vectors_data = f.read()
+            if cls._digest(chunks_data, vectors_data) != digest:
+                return None
+            chunks = [json.loads(line) for line in chunks_data.decode("utf-8").splitlines() if line.strip()]
+            packed = array("f")
+            packed.frombytes(vectors_data)
+        except (OSError, ValueError, KeyError):
+            return None
+        width = meta["dimensions"]
+        if not chunks or len(packed) != width * len(chunks):
+            return None
+        vectors = [packed[i * width:(i + 1) * width] for i in range(len(chunks))]
+        return cls(chunks, vectors, meta.get("documents"), meta.get("origin", ""))
+
+
+rag_indexes: dict[str, VectorIndex] = {}
+rag_builds: dict[str, asyncio.Task] = {}
+rag_checked: dict[str, float] = {}
+
+
+def rag_index_dir(ws_slug: str) -> str:
+    return os.path.join(RAG_INDEX_DIR, ws_slug.replace("/", "_"))
+
+
+def get_rag_index(ws_slug: str):
+    """Return the in-memory index for a workspace, loading it from disk on first use."""
+    if ws_slug not in rag_indexes:
+        index = VectorIndex.load(rag_index_dir(ws_slug))
+        if index is None:
+            return None
+        rag_indexes[ws_slug] = index
+    return rag_indexes[ws_slug]
+
+
+async def list_workspace_documents(ws_slug: str) -> dict[str, dict]:
+    """Map each document embedded in an AnythingLLM workspace to its listing entry."""
+    response = await get_client("anythingllm").get(f"/api/v1/workspace/{ws_slug}", timeout=request_timeout(30.0))
+    response.raise_for_status()
+    workspace = response.json().get("workspace", {})
+    if isinstance(workspace, list):
+        workspace = workspace[0] if workspace else {}
+    listing = {}
+    for doc in workspace.get("documents", []):
+        key = doc.get("docpath") or doc.get("filename")
+        if key:
+            listing[key] = doc
+    return listing
+
+
+def workspace_signature(doc: dict) -> str:
+    """Changes when AnythingLLM re-embeds or updates a document."""
+    return f"{doc.get('docId', '')}:{doc.get('lastUpdatedAt') or doc.get('createdAt') or ''}"
+
+
+async def fetch_workspace_documents(docs: list[dict]) -> tuple[list[dict], int]:
+    """
+    Pull the text of workspace documents (listing entries).
+    Returns ([{"title", "source", "text"}], skipped) where skipped counts
+    documents whose content could not be retrieved. Documents without
+    text are returned with an empty "text".
+    """
+    client = get_client("anythingllm")
+    semaphore = asyncio.Semaphore(RAG_FETCH_CONCURRENCY)
+
+    async def fetch(doc):
+        source = doc.get("docpath") or doc.get("filename")
+        name = os.path.basename(source)
+        async with semaphore:
+            r = await client.get(f"/api/v1/document/{name}", timeout=request_timeout(60.0))
+        if r.status_code != 200:
+            return None
+        data = r.json()
+        document = data.get("document", data)
+        metadata = doc.get("metadata") or {}
+        if isinstance(metadata, str):
+            try:
+                metadata = json.loads(metadata)
+            except ValueError:
+                metadata = {}
+        title = document.get("title") or metadata.get("title") or name
+        return {"title": title, "source": source, "text": document.get("pageContent", "")}
+
+    results = await asyncio.gather(*(fetch(doc) for doc in docs), return_exceptions=True)
+    documents = [r for r in results if isinstance(r, dict)]
+    return documents, len(results) - len(documents)
+
+
+def list_local_documents(source: str) -> dict[str, str]:
+    """Map Markdown/text files under a file or directory tree to an mtime/size signature."""
+    paths = []
+    if os.path.isdir(source):
+        for root, _dirs, files in os.walk(source):
+            paths.extend(os.path.join(root, name) for name in files if name.lower().endswith(RAG_LOCAL_EXTENSIONS))
+    elif os.path.isfile(source):
+        paths.append(source)
+    signatures = {}
+    for path in sorted(paths):
+        stat = os.stat(path)
+        signatures[path] = f"{stat.st_mtime_ns}:{stat.st_size}"
+    return signatures
+
+
+def load_local_documents(paths: list[str]) -> list[dict]:
+    documents = []
+    for path in paths:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            documents.append({"title": os.path.basename(path), "source": path, "text": f.read()})
+    return documents
+
+
+async def current_signatures(ws_slug: str, origin: str) -> tuple[dict[str, str], dict[str, dict]]:
+    """Document signatures for a workspace (or local origin) plus the workspace listing."""
+    if origin:
+        return list_local_documents(origin), {}
+    listing = await list_workspace_documents(ws_slug)
+    return {key: workspace_signature(doc) for key, doc in listing.items()}, listing
+
+
+async def build_rag_index(ws_slug: str, source: str = "", previous: VectorIndex | None = None) -> dict:
+    """
+    Chunk and embed a workspace's documents (or a local source) and persist
+    the index. With ``previous`` from the same origin, chunks and vectors of
+    documents whose signature is unchanged are reused, so only new or
+    changed documents are fetched.
+    """
+    started = time.perf_counter()
+    signatures, listing = await current_signatures(ws_slug, source)
+    rag_checked[ws_slug] = time.monotonic()
+    reuse = set()
+    if previous is not None and previous.origin == source:
+        reuse = {key for key, signature in signatures.items() if previous.documents.get(key) == signature}
+        if len(reuse) == len(signatures) == len(previous.documents):
+            # Up to date: nothing to fetch, embed or rewrite
+            return {
+                "workspace": ws_slug,
+                "documents": len(reuse),
+                "reused": len(reuse),
+                "skipped": 0,
+                "chunks": len(previous.chunks),
+                "model": resolve_route("embed")[1],
+                "fromCache": 0,
+                "seconds": round(time.perf_counter() - started, 3),
+            }
+    changed = [key for key in signatures if key not in reuse]
+    if source:
+        documents, skipped = load_local_documents(changed), 0
+    else:
+        documents, skipped = await fetch_workspace_documents([listing[key] for key in changed])
+
+    chunks, vectors = [], []
+    if reuse:
+        for row, chunk in enumerate(previous.chunks):
+            if chunk["source"] in reuse:
+                chunks.append(chunk)
+                vectors.append(previous.matrix[row])
+    new_chunks = []
+    for document in documents:
+        for part, text in enumerate(chunk_document(document["text"])):
+            new_chunks.append({"title": document["title"], "source": document["source"], "chunk": part, "text": text})
+    if not chunks and not new_chunks:
+        raise RuntimeError(f"no document text available for {ws_slug}")
+
+    model_name, cached = resolve_route("embed")[1], 0
+    if new_chunks:
+        model_name, new_vectors, _, cached = await embed_texts([c["text"] for c in new_chunks], "embed")
+        chunks.extend(new_chunks)
+        vectors.extend(new_vectors)
+
+    # Failed fetches are left out so the next check retries them
+    indexed = {key: signatures[key] for key in reuse}
+    indexed.update((document["source"], signatures[document["source"]]) for document in documents)
+    index = VectorIndex(chunks, vectors, indexed, source)
+    index.save(rag_index_dir(ws_slug))
+    rag_indexes[ws_slug] = index
+    return {
+        "workspace": ws_slug,
+        "documents": len(indexed),
+        "reused": len(reuse),
+        "skipped": skipped,
+        "chunks": len(chunks),
+        "model": model_name,
+        "fromCache": cached,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
 
-                result = f"## RAG Response ({ws_slug})\n\n{text_response}"
 
-                if sources:
-                    result += "\n\n### Sources:\n"
-                    for src in sources[:5]:  # Limit to 5 sources
-                        title = src.get("title", "Unknown")
-                        result += f"- {title}\n"
+def _finish_rag_build(task: asyncio.Task) -> None:
+    # Background builds report failures through rag_search's note, not the event loop
+    if not task.cancelled():
+        task.exception()
 
-                return result
-            else:
-                return f"Error: HTTP {response.status_code} - {response.text}"
-        except Exception as e:
-            return f"Error querying RAG: {str(e)}"
+
+def schedule_rag_build(ws_slug: str, source: str = "", rebuild: bool = False) -> asyncio.Task:
+    """Start (or join) the single background build/update of a workspace index."""
+    task = rag_builds.get(ws_slug)
+    if task is None or task.done():
+        previous = None if rebuild else get_rag_index(ws_slug)
+        task = asyncio.create_task(build_rag_index(ws_slug, source, previous))
+        task.add_done_callback(_finish_rag_build)
+        rag_builds[ws_slug] = task
+    return task
+
+
+def rag_building(ws_slug: str) -> bool:
+    task = rag_builds.get(ws_slug)
+    return task is not None and not task.done()
+
+
+@mcp.tool()
+@instrumented
+async def rag_index(workspace: str = "cf", source: str = "", rebuild: bool = False) -> str:
+    """
+    Build or update the local vector index that rag_search uses.
+    Documents come from the AnythingLLM workspace, or from local Markdown/
+    text files when ``source`` is a path. An existing index is updated in
+    place: unchanged documents are reused, and only new or changed ones are
+    fetched and embedded (through the embedding cache).
+
+    Args:
+        workspace: Workspace alias ("cf", "polarities", etc.)
+        source: Optional local file or directory to index instead
+        rebuild: Re-fetch every document instead of reusing unchanged ones
+
+    Returns:
+        JSON summary of the index (documents, reused, chunks, cache hits, time)
+    """
+    ws_slug = ANYTHINGLLM_WORKSPACES.get(workspace.lower(), workspace)
+    existing = get_rag_index(ws_slug)
+    if not source and existing is not None:
+        source = existing.origin
+    try:
+        return json.dumps(await asyncio.shield(schedule_rag_build(ws_slug, source, rebuild)))
+    except Exception as e:
+        return f"Error building index for {ws_slug}: {str(e)}"
 
 
 @mcp.tool()
+@instrumented
 async def rag_search(
     query: str,
     workspace: str = "cf",
-    top_k: int = 5
+    top_k: int = 5,
+    local: bool = True
 ) -> str:
     """
     Search for similar documents in RAG without generating a response.
     Returns raw document chunks that match the query.
+    Uses the gateway's local vector index, so no LLM generation is
+    involved. A missing index is built in the background (AnythingLLM
+    answers meanwhile). At most every RAG_CHECK_INTERVAL a background task
+    compares the index with its source and updates changed documents,
+    while the loaded index keeps answering.
 
     Args:
         query: The search query
         workspace: Workspace alias ("cf", "polarities", etc.)
         top_k: Number of results to return (default: 5)
+        local: Use the local index; False queries AnythingLLM's chat API
 
     Returns:
         List of matching document chunks with similarity scores
     """
+    if top_k < 1:
+        return "Error: top_k must be at least 1"
     ws_slug = ANYTHINGLLM_WORKSPACES.get(workspace.lower(), workspace)
 
-    headers = {}
-    if ANYTHINGLLM_API_KEY:
-        headers["Authorization"] = f"Bearer {ANYTHINGLLM_API_KEY}"
+    note = ""
+    if local:
+        started = time.perf_counter()
+        index = get_rag_index(ws_slug)
+        if index is None:
+            previous = rag_builds.get(ws_slug)
+            if previous is not None and previous.done() and not previous.cancelled() and previous.exception():
+                reason = f"last build failed: {previous.exception()}"
+            else:
+                reason = "building in the background"
+            schedule_rag_build(ws_slug)
+            note = f"\n_Local index not ready ({reason}); used AnythingLLM chat search._"
+        else:
+            refreshing = rag_building(ws_slug)
+            if not refreshing and time.monotonic() - rag_checked.get(ws_slug, 0.0) >= RAG_CHECK_INTERVAL:
+                # Off the request path; an unreachable source leaves the index as it is
+                rag_checked[ws_slug] = time.monotonic()
+                schedule_rag_build(ws_slug, index.origin)
+            try:
+                _, vectors, _, _ = await embed_texts([query], "embed")
+                hits = index.search(vectors[0], top_k)
+            except Exception as e:
+                note = f"\n_Local index unavailable ({str(e)}); used AnythingLLM chat search._"
+            else:
+                if not hits:
+                    return "No matching documents found."
+                result = [f"## Document Search Results ({ws_slug})\n"]
+                for i, (score, chunk) in enumerate(hits, 1):
+                    text = chunk["text"][:500]  # Truncate
+                    result.append(f"### {i}. {chunk['title']} (score {score:.3f})\n{text}...\n")
+                footer = f"_Local index: {len(index.chunks)} chunks, {(time.perf_counter() - started) * 1000:.0f} ms"
+                result.append(footer + ("; refresh in progress_" if refreshing else "_"))
+                return "\n".join(result)
 
     # Search documents via chat API in query mode
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        try:
-            # Use similarity search endpoint
-            response = await client.post(
-                f"{ANYTHINGLLM_URL}/api/v1/workspace/{ws_slug}/chat",
-                json={"message": query, "mode": "query"},
-                headers=headers
-            )
+    client = get_client("anythingllm")
+    try:
+        # Use similarity search endpoint
+        response = await client.post(
+            f"/api/v1/workspace/{ws_slug}/chat",
+            json={"message": query, "mode": "query"},
+            timeout=request_timeout(30.0)
+        )
+
+        if response.status_code == 200:
+            data = response.json()
+            sources = data.get("sources", [])
 
-            if response.status_code == 200:
-                data = response.json()
-                sources = data.get("sources", [])
+            if not sources:
+                return "No matching documents found."
 
-                if not sources:
-                    return "No matching documents found."
+            result = [f"## Document Search Results ({ws_slug})\n"]
+            for i, src in enumerate(sources[:top_k], 1):
+                title = src.get("title", "Unknown")
+                text = src.get("text", "")[:500]  # Truncate
+                result.append(f"### {i}. {title}\n{text}...\n")
 
-                result = [f"## Document Search Results ({ws_slug})\n"]
-                for i, src in enumerate(sources[:top_k], 1):
-                    title = src.get("title", "Unknown")
-                    text = src.get("text", "")[:500]  # Truncate
-                    result.append(f"### {i}. {title}\n{text}...\n")
-
-                return "\n".join(result)
-            else:
-                return f"Error: HTTP {response.status_code}"
-        except Exception as e:
-            return f"Error: {str(e)}"
+            return "\n".join(result) + note
+        else:
+            return f"Error: HTTP {response.status_code}"
+    except Exception as e:
+        return f"Error: {str(e)}"
 
 
 if __name__ == "__main__":
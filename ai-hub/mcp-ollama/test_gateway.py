@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""
+Gateway admission, coalescing and on-disk index tests (run with pytest or directly)
+"""
+
+import asyncio
+import os
+import tempfile
+
+import server
+
+
+async def until_queued(gate, count):
+    while len(gate.waiting) < count:
+        await asyncio.sleep(0)
+
+
+def test_gate_admits_by_priority_then_arrival():
+    async def scenario():
+        gate = server.AdmissionGate("hp", limit=1, max_queue=4, max_wait=5)
+        order = []
+
+        async def job(name, priority):
+            await gate.acquire(priority)
+            order.append(name)
+
+        await gate.acquire()
+        tasks = [asyncio.create_task(job(name, priority)) for name, priority in
+                 [("low", 2), ("normal-1", 1), ("high", 0), ("normal-2", 1)]]
+        await until_queued(gate, 4)
+        for _ in tasks:
+            gate.release()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+        return order, gate.stats()
+
+    order, stats = asyncio.run(scenario())
+    assert order == ["high", "normal-1", "normal-2", "low"]
+    assert stats["admitted"] == 5 and stats["queued"] == 0
+
+
+def test_full_gate_sheds_lowest_priority():
+    async def scenario():
+        gate = server.AdmissionGate("pi", limit=1, max_queue=1, max_wait=5)
+        await gate.acquire()
+        low = asyncio.create_task(gate.acquire(2))
+        await until_queued(gate, 1)
+
+        # An equal-priority newcomer is shed; a higher-priority one takes the queued slot
+        try:
+            await gate.acquire(2)
+            raise AssertionError("expected NodeBusy")
+        except server.NodeBusy:
+            pass
+        high = asyncio.create_task(gate.acquire(0))
+        await until_queued(gate, 1)
+        try:
+            await low
+            raise AssertionError("expected NodeBusy")
+        except server.NodeBusy as e:
+            assert "preempted" in str(e)
+
+        gate.release()
+        await high
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert (stats["shed"], stats["evicted"], stats["running"]) == (1, 1, 1)
+
+
+def test_gate_wait_timeout_and_cancel_keep_slots_consistent():
+    async def scenario():
+        gate = server.AdmissionGate("pi", limit=1, max_queue=4, max_wait=0.05)
+        await gate.acquire()
+        try:
+            await gate.acquire()
+            raise AssertionError("expected NodeBusy")
+        except server.NodeBusy:
+            pass
+
+        waiter = asyncio.create_task(gate.acquire())
+        await until_queued(gate, 1)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+
+        gate.release()
+        await gate.acquire()
+        return gate.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["timedOut"] == 1
+    assert (stats["running"], stats["queued"]) == (1, 0)
+
+
+def test_coalesce_runs_factory_once_for_concurrent_callers():
+    async def scenario():
+        calls = []
+        release = asyncio.Event()
+
+        async def factory():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        before = dict(server.coalesce_counters)
+        callers = [asyncio.create_task(server.coalesce("same-key", factory)) for _ in range(3)]
+        await asyncio.sleep(0)
+        # One caller giving up must not cancel the shared run
+        callers[0].cancel()
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+
+        after = await server.coalesce("same-key", factory)
+        return calls, results, after, before
+
+    calls, results, after, before = asyncio.run(scenario())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == ["answer", "answer"]
+    # The finished run is forgotten, so a later call starts a new one
+    assert len(calls) == 2 and after == "answer"
+    assert server.coalesce_counters["leaders"] - before["leaders"] == 2
+    assert server.coalesce_counters["followers"] - before["followers"] == 2
+    assert "same-key" not in server._coalesced
+
+
+def test_coalesce_cancels_run_when_last_waiter_leaves():
+    async def scenario():
+        started = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def factory():
+            started.set()
+            try:
+                await asyncio.sleep(60)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        caller = asyncio.create_task(server.coalesce("abandoned", factory))
+        await started.wait()
+        caller.cancel()
+        await asyncio.gather(caller, return_exceptions=True)
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+    asyncio.run(scenario())
+
+
+def test_vector_index_round_trip_and_verification():
+    chunks = [{"source": "a.md", "text": "alpha"}, {"source": "b.md", "text": "beta"}]
+    index = server.VectorIndex(chunks, [[1.0, 0.0], [0.0, 2.0]], {"a.md": "sig-a", "b.md": "sig-b"}, "/docs")
+
+    with tempfile.TemporaryDirectory() as directory:
+        index.save(directory)
+        loaded = server.VectorIndex.load(directory)
+        assert loaded.chunks == chunks
+        assert loaded.documents == {"a.md": "sig-a", "b.md": "sig-b"}
+        assert loaded.origin == "/docs"
+        assert loaded.search([0.1, 1.0], 1)[0][1]["text"] == "beta"
+
+        # A rebuild keeps the previous generation for readers still loading it
+        first = sorted(os.listdir(directory))
+        server.VectorIndex(chunks[:1], [[1.0, 0.0]]).save(directory)
+        assert set(first) <= set(os.listdir(directory))
+        assert len(server.VectorIndex.load(directory).chunks) == 1
+
+        # Vectors that do not match the digest in meta.json are rejected
+        vectors = next(name for name in os.listdir(directory) if name.startswith("vectors-") and name not in first)
+        with open(os.path.join(directory, vectors), "r+b") as f:
+            f.write(b"\xff\xff\xff\xff")
+        assert server.VectorIndex.load(directory) is None
+
+
+def test_embedding_store_shares_vectors_between_instances():
+    with tempfile.TemporaryDirectory() as directory:
+        writer = server.EmbeddingStore(directory)
+        reader = server.EmbeddingStore(directory)
+        first, second = writer.hash_text("first"), writer.hash_text("second")
+
+        assert reader.lookup("nomic-embed-text", [first]) == {}
+        writer.add("nomic-embed-text", {first: [0.5, 1.5]})
+        # The reader picks up rows appended by another instance
+        assert reader.lookup("nomic-embed-text", [first, second]) == {first: [0.5, 1.5]}
+
+        # A new output size switches files instead of mixing record widths
+        writer.add("nomic-embed-text", {second: [1.0, 2.0, 3.0]})
+        assert reader.lookup("nomic-embed-text", [second]) == {second: [1.0, 2.0, 3.0]}
+        assert reader.counters["misses"] == 2
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"ok {name}")
@@ -2,98 +2,1329 @@
 """
 Document Converter - Python fallback for document to Markdown conversion
 Uses marker-pdf for high-quality PDF to Markdown conversion
+
+Usage:
+    python document_converter.py <input_file> [--workers 4] [--route auto|auto-page|marker|pdfplumber|pypdf]
+    python document_converter.py <input_file> --stream
+    python document_converter.py --serve [--socket /tmp/carbonac-converter.sock]
+    python document_converter.py --batch ./archive --output-dir ./converted [--jobs 4]
+    python document_converter.py --cache-stats
+
+PDFs are pre-scanned (a pypdf probe of sampled pages: text layer, images,
+ruling lines; pdfplumber only confirms inconclusive pages) to pick marker
+only for scanned pages, pdfplumber for tabular pages and pypdf for plain
+born-digital text; --route forces one extractor, and the scan is skipped
+when pypdf is the only extractor installed.
+
+Conversions are cached on disk (CONVERTER_CACHE_DIR, LRU-bounded by
+CONVERTER_CACHE_MAX_MB) by input content hash plus converter version and
+options, so re-uploads of the same file skip marker/mammoth.
+
+PDF inputs are memory-mapped and read in PAGE_WINDOW page windows; with
+--max-rss-mb (CONVERTER_MAX_RSS_MB) the converter switches the remaining
+pages to pypdf once the process crosses the ceiling instead of being
+OOM-killed.
+
+Server mode loads the marker models once and answers JSON-lines requests
+(one object per line) on stdin/stdout or on a Unix socket:
+    {"id": "1", "op": "convert", "path": "/tmp/input.pdf", "workers": 1, "route": "auto"}
+    {"id": "2", "op": "health"}
+    {"id": "3", "op": "shutdown"}
+With "stream": true a convert request first gets its stream frames (below)
+tagged with the request id, then a final response carrying the end frame.
+
+Stream mode writes one NDJSON frame per converted page (or marker window):
+    {"type": "start", "file": "input.pdf"}
+    {"type": "page", "page": 1, "pages": 1, "pageCount": 12, "markdown": "...", "seconds": 0.04}
+    {"type": "end", "pages": 12, "pageCount": 12, "seconds": 0.5}
 """
 
-import sys
+import argparse
+import contextlib
+import gc
+import glob
+import hashlib
+import importlib.util
+import json
+import mmap
 import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from functools import lru_cache
+from importlib import metadata
 from pathlib import Path
+from typing import Optional
+
+MARKER_LANGS = ["tr", "en"]
+MARKER_BATCH_MULTIPLIER = 2
+DEFAULT_STREAM_WINDOW = 10
+
+# Route planner: "auto" picks one extractor per document, "auto-page" per page
+PDF_ROUTES = ["auto", "auto-page", "marker", "pdfplumber", "pypdf"]
+DEFAULT_ROUTE = os.environ.get("CONVERTER_PDF_ROUTE", "auto")
+ANALYSIS_SAMPLE_PAGES = 5
+MIN_TEXT_LAYER_CHARS = 50
+SCANNED_IMAGE_COVERAGE = 0.6
+SCANNED_PAGE_RATIO = 0.2
+TABLE_MIN_EDGES = 8
+# Path operators that draw straight segments ("x y w h re", "x y l"): table ruling candidates
+RULING_OPERATOR = re.compile(rb"\d\s+(?:re|l)(?=\s)")
+
+# Memory bounds: pages per reader/marker window and an optional RSS ceiling
+PAGE_WINDOW = int(os.environ.get("CONVERTER_PAGE_WINDOW", "25"))
+MAX_RSS_MB = int(os.environ.get("CONVERTER_MAX_RSS_MB", "0"))
+
+# Bump when the Markdown produced for the same input/settings changes
+CACHE_FORMAT_VERSION = 1
+DEFAULT_CACHE_DIR = os.environ.get(
+    "CONVERTER_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "carbonac-converter-cache"),
+)
+DEFAULT_CACHE_MAX_MB = int(os.environ.get("CONVERTER_CACHE_MAX_MB", "512"))
+UNCACHEABLE_PREFIXES = ("PDF extraction error:", "Unsupported file format")
+# Plan metadata stored beside an entry so a hit can report its route without a pre-scan
+CACHED_INFO_FIELDS = ("route", "routeReason", "requestedRoute", "pageCount", "segments")
+SUPPORTED_EXTENSIONS = ['.pdf', '.docx', '.doc', '.txt', '.md']
+
+# marker models are shared process-wide and are not thread-safe
+MARKER_LOCK = threading.Lock()
 
-def convert_pdf_to_markdown(input_path: str) -> str:
-    """Convert PDF to Markdown using marker-pdf"""
+
+@lru_cache(maxsize=1)
+def load_marker_models():
+    """Load marker models once per process and keep them resident"""
+    from marker.models import load_all_models
+
+    return load_all_models()
+
+
+def convert_pdf_to_markdown(
+    input_path: str,
+    workers: int = 1,
+    route: str = DEFAULT_ROUTE,
+    info: Optional[dict] = None,
+) -> str:
+    """Convert PDF to Markdown with the extractor(s) picked by the route planner"""
     try:
-        from marker.convert import convert_single_pdf
-        from marker.models import load_all_models
-        
-        # Load models
-        model_lst = load_all_models()
-        
-        # Convert
-        full_text, images, out_meta = convert_single_pdf(
-            input_path, 
-            model_lst,
-            max_pages=None,
-            langs=["tr", "en"],
-            batch_multiplier=2,
-        )
-        
-        return full_text
-        
+        chunks = iter_pdf_chunks(input_path, workers=workers, route=route, info=info)
+        return '\n\n'.join(markdown for _index, _pages, _count, markdown in chunks)
     except ImportError:
         # Fallback to basic extraction
         return extract_text_fallback(input_path)
+    except Exception as e:
+        return f"PDF extraction error: {str(e)}"
 
 def convert_docx_to_markdown(input_path: str) -> str:
     """Convert DOCX to Markdown"""
     try:
         import mammoth
-        
+
         with open(input_path, "rb") as docx_file:
             result = mammoth.convert_to_markdown(docx_file)
             return result.value
-            
+
     except ImportError:
         # Fallback
         return extract_text_fallback(input_path)
 
+def _import_pdf_reader():
+    """Return a PdfReader class from PyPDF2 or its successor pypdf"""
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        from pypdf import PdfReader
+    return PdfReader
+
+@contextlib.contextmanager
+def open_pdf_stream(input_path: str):
+    """Open a PDF as a read-only memory map so pages are paged in on demand"""
+    with open(input_path, 'rb') as file:
+        try:
+            stream = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            # Empty files and some filesystems cannot be mapped
+            yield file
+            return
+        try:
+            yield stream
+        finally:
+            stream.close()
+
+def current_rss_mb() -> float:
+    """Resident set size of this process in MB (peak RSS where /proc is missing)"""
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            resident_pages = int(statm.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports KB, macOS bytes
+        return peak / 1024 if sys.platform != 'darwin' else peak / (1024 * 1024)
+
+def count_pdf_pages(input_path: str) -> int:
+    PdfReader = _import_pdf_reader()
+    with open_pdf_stream(input_path) as stream:
+        return len(PdfReader(stream).pages)
+
+def resolve_worker_count(workers: int) -> int:
+    """0 or a negative value means one worker per CPU core"""
+    if workers is None or workers <= 0:
+        return os.cpu_count() or 1
+    return workers
+
+def split_page_ranges(page_count: int, workers: int, pages_per_chunk: int = 0, first_page: int = 0) -> list:
+    """Split [first_page, page_count) into contiguous (start, end) ranges"""
+    total = page_count - first_page
+    if total <= 0:
+        return []
+    if pages_per_chunk <= 0:
+        # A few chunks per worker keeps the pool busy when page cost is uneven;
+        # each chunk reopens the reader, so PAGE_WINDOW also bounds its caches
+        pages_per_chunk = max(1, min(PAGE_WINDOW, -(-total // (max(1, workers) * 4))))
+    return [
+        (start, min(start + pages_per_chunk, page_count))
+        for start in range(first_page, page_count, pages_per_chunk)
+    ]
+
+def _table_to_markdown(table: list) -> str:
+    header, *rows = table
+    lines = [
+        "| " + " | ".join(str(cell or "") for cell in header) + " |",
+        "|" + "|".join("---" for _ in header) + "|",
+    ]
+    lines.extend("| " + " | ".join(str(cell or "") for cell in row) + " |" for row in rows)
+    return "\n".join(lines)
+
+def extract_page_range(input_path: str, start: int, end: int, extractor: str = "pypdf") -> list:
+    """Extract pages [start, end) with pypdf or pdfplumber; runs inside pool workers"""
+    if extractor == "pdfplumber":
+        import pdfplumber
+
+        parts = []
+        with pdfplumber.open(input_path) as pdf:
+            for index in range(start, end):
+                page = pdf.pages[index]
+                blocks = [page.extract_text() or '']
+                blocks.extend(_table_to_markdown(table) for table in page.extract_tables() if table)
+                parts.append('\n\n'.join(block for block in blocks if block))
+                page.flush_cache()
+        return parts
+
+    PdfReader = _import_pdf_reader()
+    with open_pdf_stream(input_path) as stream:
+        reader = PdfReader(stream)
+        return [reader.pages[index].extract_text() or '' for index in range(start, end)]
+
+def iter_pdf_page_text(
+    input_path: str,
+    workers: int = 1,
+    pages_per_chunk: int = 0,
+    extractor: str = "pypdf",
+    first_page: int = 0,
+    end_page: Optional[int] = None,
+):
+    """Yield (page_index, text) in page order, sharding ranges over a process pool"""
+    if end_page is None:
+        end_page = count_pdf_pages(input_path)
+    workers = resolve_worker_count(workers)
+    ranges = split_page_ranges(end_page, workers, pages_per_chunk, first_page)
+
+    if workers == 1 or len(ranges) <= 1:
+        for start, end in ranges:
+            for offset, text in enumerate(extract_page_range(input_path, start, end, extractor)):
+                yield start + offset, text
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=min(workers, len(ranges))) as pool:
+        futures = [pool.submit(extract_page_range, input_path, start, end, extractor) for start, end in ranges]
+        # Consume in submission order so output stays in page order
+        for (start, _end), future in zip(ranges, futures):
+            for offset, text in enumerate(future.result()):
+                yield start + offset, text
+
+def extract_pdf_text_parallel(input_path: str, workers: int = 0, pages_per_chunk: int = 0) -> str:
+    """Extract PDF text page-sharded across a process pool, reassembled in order"""
+    try:
+        return '\n\n'.join(
+            text for _index, text in iter_pdf_page_text(input_path, workers, pages_per_chunk)
+        )
+    except Exception as e:
+        return f"PDF extraction error: {str(e)}"
+
 def extract_text_fallback(input_path: str) -> str:
     """Fallback text extraction"""
     ext = Path(input_path).suffix.lower()
-    
+
     if ext == '.pdf':
-        try:
-            import PyPDF2
-            
-            with open(input_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                text_parts = []
-                
-                for page in reader.pages:
-                    text_parts.append(page.extract_text())
-                
-                return '\n\n'.join(text_parts)
-                
-        except Exception as e:
-            return f"PDF extraction error: {str(e)}"
-    
+        return extract_pdf_text_parallel(input_path, workers=1)
+
     elif ext in ['.txt', '.md']:
         with open(input_path, 'r', encoding='utf-8') as file:
             return file.read()
-    
+
     return "Unsupported file format"
 
-def main():
-    if len(sys.argv) < 2:
-        print("Usage: python document_converter.py <input_file>", file=sys.stderr)
-        sys.exit(1)
-    
-    input_path = sys.argv[1]
-    
-    if not os.path.exists(input_path):
-        print(f"File not found: {input_path}", file=sys.stderr)
-        sys.exit(1)
-    
+def available_pdf_routes() -> set:
+    routes = {"pypdf"}
+    if importlib.util.find_spec("pdfplumber") is not None:
+        routes.add("pdfplumber")
+    if importlib.util.find_spec("marker") is not None:
+        routes.add("marker")
+    return routes
+
+def sample_page_indexes(page_count: int, sample_pages: int) -> list:
+    """Evenly spread sample of page indexes, always including first and last"""
+    if sample_pages <= 0 or sample_pages >= page_count:
+        return list(range(page_count))
+    if sample_pages == 1:
+        return [0]
+    step = (page_count - 1) / (sample_pages - 1)
+    return sorted({round(i * step) for i in range(sample_pages)})
+
+def _analyze_pages_pdfplumber(input_path: str, indexes: list) -> list:
+    import pdfplumber
+
+    pages = []
+    with pdfplumber.open(input_path) as pdf:
+        for index in indexes:
+            page = pdf.pages[index]
+            area = float(page.width * page.height) or 1.0
+            image_area = sum(
+                max(0.0, float(image["x1"] - image["x0"])) * max(0.0, float(image["bottom"] - image["top"]))
+                for image in page.images
+            )
+            # Ruling lines are cheap to count; only then pay for table detection
+            has_rules = len(page.edges) >= TABLE_MIN_EDGES
+            pages.append({
+                "page": index + 1,
+                "textChars": len(page.chars),
+                "images": len(page.images),
+                "rules": len(page.edges),
+                "imageCoverage": round(min(1.0, image_area / area), 3),
+                "tableLikely": bool(has_rules and page.find_tables()),
+            })
+            page.flush_cache()
+    return pages
+
+def _analyze_pages_pypdf(input_path: str, indexes: list) -> list:
+    """Probe pages without layout analysis: text length, image XObjects, ruling operators"""
+    PdfReader = _import_pdf_reader()
+    pages = []
+    with open_pdf_stream(input_path) as stream:
+        reader = PdfReader(stream)
+        for index in indexes:
+            page = reader.pages[index]
+            images = 0
+            try:
+                xobjects = page["/Resources"]["/XObject"].get_object()
+                images = sum(1 for obj in xobjects.values() if obj.get_object().get("/Subtype") == "/Image")
+            except (KeyError, TypeError, AttributeError):
+                pass
+            try:
+                contents = page.get_contents()
+                rules = len(RULING_OPERATOR.findall(contents.get_data())) if contents is not None else 0
+            except Exception:
+                rules = 0
+            pages.append({
+                "page": index + 1,
+                "textChars": len((page.extract_text() or '').strip()),
+                "images": images,
+                "rules": rules,
+                "imageCoverage": None,
+                "tableLikely": False,
+            })
+    return pages
+
+def _needs_layout_analysis(page: dict) -> bool:
+    """Pages the pypdf probe cannot settle: possible tables, or images over a thin text layer"""
+    if page["rules"] >= TABLE_MIN_EDGES:
+        return True
+    return bool(page["images"]) and MIN_TEXT_LAYER_CHARS <= page["textChars"] < 4 * MIN_TEXT_LAYER_CHARS
+
+@lru_cache(maxsize=32)
+def _analyze_pdf_cached(input_path: str, mtime_ns: int, size: int, sample_pages: int) -> dict:
+    started = time.perf_counter()
+    page_count = count_pdf_pages(input_path)
+    indexes = sample_page_indexes(page_count, sample_pages)
+    pages = _analyze_pages_pypdf(input_path, indexes)
+    if importlib.util.find_spec("pdfplumber") is not None:
+        # pdfplumber lays out the whole page; only pay for it where the probe is inconclusive
+        uncertain = [page["page"] - 1 for page in pages if _needs_layout_analysis(page)]
+        if uncertain:
+            detailed = {page["page"]: page for page in _analyze_pages_pdfplumber(input_path, uncertain)}
+            pages = [detailed.get(page["page"], page) for page in pages]
+    return {
+        "pageCount": page_count,
+        "sampled": pages,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+
+def analyze_pdf(input_path: str, sample_pages: int = ANALYSIS_SAMPLE_PAGES) -> dict:
+    """Cheap pre-scan of sampled pages: text layer, images, table likelihood (pdfplumber only where needed)"""
+    stat = os.stat(input_path)
+    return _analyze_pdf_cached(os.path.abspath(input_path), stat.st_mtime_ns, stat.st_size, sample_pages)
+
+def classify_page(page: dict) -> str:
+    """Pick the cheapest extractor that can handle a single analyzed page"""
+    coverage = page["imageCoverage"]
+    # Only pages carrying images can hide text that needs OCR
+    if page["images"]:
+        if page["textChars"] < MIN_TEXT_LAYER_CHARS:
+            return "marker"
+        if coverage is not None and coverage >= SCANNED_IMAGE_COVERAGE and page["textChars"] < 4 * MIN_TEXT_LAYER_CHARS:
+            return "marker"
+    if page["tableLikely"]:
+        return "pdfplumber"
+    return "pypdf"
+
+def _available_route(route: str, available: set) -> str:
+    # marker -> pdfplumber -> pypdf, in decreasing cost
+    if route == "marker" and "marker" not in available:
+        route = "pdfplumber"
+    if route == "pdfplumber" and "pdfplumber" not in available:
+        route = "pypdf"
+    return route
+
+def plan_pdf_routes(input_path: str, route: str = DEFAULT_ROUTE) -> dict:
+    """Decide which extractor handles which pages; returns the plan with its reasoning"""
+    available = available_pdf_routes()
+
+    if route not in ("auto", "auto-page") or len(available) == 1:
+        if route in ("auto", "auto-page"):
+            # Nothing to choose between: skip the pre-scan
+            chosen, reason = "pypdf", "only pypdf installed"
+        else:
+            chosen = _available_route(route, available)
+            reason = "forced" if chosen == route else f"{route} not installed"
+        page_count = count_pdf_pages(input_path)
+        return {
+            "route": chosen,
+            "requested": route,
+            "reason": reason,
+            "segments": [(0, page_count, chosen)] if page_count else [],
+            "pageCount": page_count,
+            "analysis": None,
+        }
+
+    per_page = route == "auto-page"
+    analysis = analyze_pdf(input_path, sample_pages=0 if per_page else ANALYSIS_SAMPLE_PAGES)
+    page_count = analysis["pageCount"]
+    page_routes = {page["page"] - 1: classify_page(page) for page in analysis["sampled"]}
+    counts = {}
+    for value in page_routes.values():
+        counts[value] = counts.get(value, 0) + 1
+
+    if per_page:
+        segments = []
+        for index in range(page_count):
+            value = _available_route(page_routes[index], available)
+            if segments and segments[-1][2] == value:
+                segments[-1] = (segments[-1][0], index + 1, value)
+            else:
+                segments.append((index, index + 1, value))
+        chosen = segments[0][2] if len(segments) == 1 else "mixed"
+        reason = "per-page: " + ", ".join(f"{key}={value}" for key, value in sorted(counts.items()))
+    else:
+        sampled = max(1, len(page_routes))
+        if counts.get("marker", 0) / sampled >= SCANNED_PAGE_RATIO:
+            chosen, reason = "marker", f"{counts['marker']}/{sampled} sampled pages lack a usable text layer"
+        elif counts.get("pdfplumber", 0):
+            chosen, reason = "pdfplumber", f"{counts['pdfplumber']}/{sampled} sampled pages look tabular"
+        else:
+            chosen, reason = "pypdf", f"text layer on {sampled}/{sampled} sampled pages"
+        resolved = _available_route(chosen, available)
+        if resolved != chosen:
+            reason += f"; {chosen} not installed"
+            chosen = resolved
+        segments = [(0, page_count, chosen)] if page_count else []
+
+    return {
+        "route": chosen,
+        "requested": route,
+        "reason": reason,
+        "segments": segments,
+        "pageCount": page_count,
+        "analysis": analysis,
+    }
+
+def iter_marker_windows(input_path: str, start_page: int, end_page: int, window: Optional[int] = None):
+    """Yield (page_index, pages_covered, markdown) for marker runs over page windows"""
+    from marker.convert import convert_single_pdf
+
+    model_lst = load_marker_models()
+    window = window or (end_page - start_page)
+    for start in range(start_page, end_page, window):
+        pages = min(window, end_page - start)
+        with MARKER_LOCK:
+            full_text, images, out_meta = convert_single_pdf(
+                input_path,
+                model_lst,
+                start_page=start,
+                max_pages=pages,
+                langs=MARKER_LANGS,
+                batch_multiplier=MARKER_BATCH_MULTIPLIER,
+            )
+        yield start, pages, full_text
+
+def iter_pdf_chunks(
+    input_path: str,
+    workers: int = 1,
+    window: Optional[int] = None,
+    route: str = DEFAULT_ROUTE,
+    info: Optional[dict] = None,
+    max_rss_mb: Optional[int] = None,
+):
+    """Yield (page_index, pages_covered, page_count, markdown) following the route plan.
+
+    Text-layer segments yield one chunk per page; marker segments yield one
+    chunk per ``window`` pages (the whole segment when window is None).
+    With an RSS ceiling, marker runs in PAGE_WINDOW windows and once the
+    ceiling is crossed the remaining pages fall back to pypdf.
+    """
+    max_rss_mb = MAX_RSS_MB if max_rss_mb is None else max_rss_mb
+    started = time.perf_counter()
+    plan = plan_pdf_routes(input_path, route)
+    page_count = plan["pageCount"]
+    plan_seconds = round(time.perf_counter() - started, 3)
+    timings = {}
+    guard = {
+        "maxRssMb": max_rss_mb or None,
+        "peakRssMb": round(current_rss_mb(), 1),
+        "tripped": False,
+        "fallbackFromPage": None,
+    }
+    if max_rss_mb and not window:
+        window = PAGE_WINDOW
+
+    def over_ceiling(next_page: int) -> bool:
+        rss = current_rss_mb()
+        guard["peakRssMb"] = max(guard["peakRssMb"], round(rss, 1))
+        if max_rss_mb and rss >= max_rss_mb and not guard["tripped"]:
+            gc.collect()
+            guard["tripped"] = True
+            guard["fallbackFromPage"] = next_page + 1
+        return guard["tripped"]
+
+    for start, end, segment_route in plan["segments"]:
+        segment_started = time.perf_counter()
+        next_page = start
+        if over_ceiling(next_page):
+            segment_route = "pypdf"
+        if segment_route == "marker":
+            for index, pages, markdown in iter_marker_windows(input_path, start, end, window):
+                yield index, pages, page_count, markdown
+                next_page = index + pages
+                if next_page < end and over_ceiling(next_page):
+                    break
+        elif segment_route != "pypdf":
+            for index, text in iter_pdf_page_text(
+                input_path,
+                workers=workers,
+                extractor=segment_route,
+                first_page=start,
+                end_page=end,
+            ):
+                yield index, 1, page_count, text
+                next_page = index + 1
+                if next_page < end and over_ceiling(next_page):
+                    break
+        timings[segment_route] = timings.get(segment_route, 0.0) + time.perf_counter() - segment_started
+
+        if next_page < end:
+            # pypdf segments, or the rest of a segment after the guard tripped
+            fallback_started = time.perf_counter()
+            for index, text in iter_pdf_page_text(
+                input_path,
+                workers=workers,
+                extractor="pypdf",
+                first_page=next_page,
+                end_page=end,
+            ):
+                yield index, 1, page_count, text
+                over_ceiling(index + 1)
+            timings["pypdf"] = timings.get("pypdf", 0.0) + time.perf_counter() - fallback_started
+
+    if info is not None:
+        analysis = plan["analysis"]
+        info.update({
+            "route": plan["route"],
+            "routeReason": plan["reason"],
+            "requestedRoute": plan["requested"],
+            "pageCount": page_count,
+            "segments": [
+                {"startPage": start + 1, "endPage": end, "route": segment_route}
+                for start, end, segment_route in plan["segments"]
+            ],
+            "analysis": {
+                "sampledPages": len(analysis["sampled"]),
+                "seconds": analysis["seconds"],
+                "pages": analysis["sampled"],
+            } if analysis else None,
+            "timing": {
+                "planSeconds": plan_seconds,
+                "routeSeconds": {key: round(value, 3) for key, value in timings.items()},
+                "totalSeconds": round(time.perf_counter() - started, 3),
+            },
+            "memoryGuard": guard,
+        })
+
+def convert_document(
+    input_path: str,
+    workers: int = 1,
+    route: str = DEFAULT_ROUTE,
+    info: Optional[dict] = None,
+) -> str:
+    """Convert any supported document to Markdown based on its extension"""
     ext = Path(input_path).suffix.lower()
-    
+
     if ext == '.pdf':
-        result = convert_pdf_to_markdown(input_path)
+        return convert_pdf_to_markdown(input_path, workers=workers, route=route, info=info)
     elif ext in ['.docx', '.doc']:
-        result = convert_docx_to_markdown(input_path)
+        return convert_docx_to_markdown(input_path)
     elif ext in ['.txt', '.md']:
         with open(input_path, 'r', encoding='utf-8') as f:
-            result = f.read()
+            return f.read()
+    return extract_text_fallback(input_path)
+
+def iter_document_chunks(
+    input_path: str,
+    workers: int = 1,
+    window: int = DEFAULT_STREAM_WINDOW,
+    route: str = DEFAULT_ROUTE,
+    info: Optional[dict] = None,
+):
+    """Yield (page_index, pages_covered, page_count, markdown) as soon as each chunk is ready"""
+    ext = Path(input_path).suffix.lower()
+
+    if ext != '.pdf':
+        yield 0, 1, 1, convert_document(input_path, workers=workers)
+        return
+
+    yield from iter_pdf_chunks(input_path, workers=workers, window=window, route=route, info=info)
+
+def stream_document(
+    input_path: str,
+    out=None,
+    workers: int = 1,
+    window: int = DEFAULT_STREAM_WINDOW,
+    cache=None,
+    route: str = DEFAULT_ROUTE,
+    emit=None,
+) -> int:
+    """Write NDJSON frames (start, page..., end) for a conversion, or pass them to ``emit``; returns the page count"""
+    if emit is None:
+        out = out or sys.stdout
+
+        def emit(frame: dict) -> None:
+            out.write(json.dumps(frame, ensure_ascii=False) + "\n")
+            out.flush()
+
+    started = time.perf_counter()
+    last = started
+    emitted = 0
+    page_count = None
+    emit({"type": "start", "file": os.path.basename(input_path)})
+
+    info = {}
+    cache_key = cache.key_for(input_path, workers, route) if cache is not None and is_cacheable(input_path) else None
+    cached = cache.get(cache_key) if cache_key else None
+    if cached is not None:
+        info.update(cached_conversion_info(cache, cache_key, input_path, workers, route))
+        cached_pages = info.get("pageCount")
+        if not cached_pages:
+            # Entry written before page counts were stored beside it
+            cached_pages = count_pdf_pages(input_path) if Path(input_path).suffix.lower() == '.pdf' else 1
+        # One frame carries the whole document but reports every page it covers
+        chunks = iter([(0, cached_pages, cached_pages, cached)])
     else:
-        result = extract_text_fallback(input_path)
-    
+        chunks = iter_document_chunks(input_path, workers, window, route=route, info=info)
+    parts = []
+
+    for index, pages, page_count, markdown in chunks:
+        if cache_key and cached is None:
+            parts.append(markdown)
+        now = time.perf_counter()
+        emitted += pages
+        emit({
+            "type": "page",
+            "page": index + 1,
+            "pages": pages,
+            "pageCount": page_count,
+            "markdown": markdown,
+            "seconds": round(now - last, 3),
+        })
+        last = now
+
+    if cache_key and cached is None and not info.get("memoryGuard", {}).get("tripped"):
+        cache.put(cache_key, '\n\n'.join(parts), info)
+
+    emit({
+        "type": "end",
+        "pages": emitted,
+        "pageCount": page_count if page_count is not None else emitted,
+        "cached": cached is not None,
+        "seconds": round(time.perf_counter() - started, 3),
+        "metadata": info or None,
+    })
+    return emitted
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+def _route_version(route: str) -> str:
+    if route == "marker":
+        return _package_version("marker-pdf")
+    if route == "pdfplumber":
+        return _package_version("pdfplumber")
+    if importlib.util.find_spec("PyPDF2") is not None:
+        return "PyPDF2-" + _package_version("PyPDF2")
+    return _package_version("pypdf")
+
+def resolve_converter(input_path: str, workers: int = 1, route: str = DEFAULT_ROUTE) -> tuple:
+    """Return the (converter, version) that convert_document will use for this input"""
+    ext = Path(input_path).suffix.lower()
+
+    if ext == '.pdf':
+        plan = plan_pdf_routes(input_path, route)
+        # Segment layout is part of the version so per-page plans key separately
+        version = ";".join(
+            f"{start}-{end}:{segment_route}@{_route_version(segment_route)}"
+            for start, end, segment_route in plan["segments"]
+        )
+        return plan["route"], version
+    if ext in ['.docx', '.doc'] and importlib.util.find_spec("mammoth") is not None:
+        return "mammoth", _package_version("mammoth")
+    return "text", "builtin"
+
+def extractor_versions(input_path: str) -> dict:
+    """Versions of every extractor the planner could pick for this input, without opening it"""
+    ext = Path(input_path).suffix.lower()
+
+    if ext == '.pdf':
+        return {route: _route_version(route) for route in sorted(available_pdf_routes())}
+    if ext in ['.docx', '.doc'] and importlib.util.find_spec("mammoth") is not None:
+        return {"mammoth": _package_version("mammoth")}
+    return {"text": "builtin"}
+
+def hash_file(input_path: str, chunk_size: int = 1024 * 1024) -> str:
+    digest = hashlib.sha256()
+    with open(input_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    """On-disk Markdown cache keyed by input content and converter settings.
+
+    Entries are plain ``<key>.md`` files; reads refresh the file mtime so the
+    oldest mtime is the least recently used entry when the size limit is hit.
+    """
+
+    def __init__(self, root: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_MAX_MB * 1024 * 1024):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.stats_path = self.root / "stats.json"
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+
+    def key_for(self, input_path: str, workers: int = 1, route: str = DEFAULT_ROUTE) -> str:
+        # The route plan is a function of content, requested route and installed
+        # extractors, so the key needs no pre-scan; that only runs on a miss
+        fingerprint = {
+            "format": CACHE_FORMAT_VERSION,
+            "content": hash_file(input_path),
+            "route": route,
+            "extractors": extractor_versions(input_path),
+            "options": {
+                "langs": MARKER_LANGS,
+                "batch_multiplier": MARKER_BATCH_MULTIPLIER,
+            },
+        }
+        encoded = json.dumps(fingerprint, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(encoded).hexdigest()
+
+    def _entry_path(self, key: str) -> Path:
+        return self.root / f"{key}.md"
+
+    def _metadata_path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def get(self, key: str) -> Optional[str]:
+        path = self._entry_path(key)
+        try:
+            # newline="" keeps carriage returns from the extractor byte-for-byte
+            with open(path, 'r', encoding='utf-8', newline='') as file:
+                markdown = file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            self._record("misses")
+            return None
+        self._record("hits")
+        return markdown
+
+    def metadata(self, key: str) -> dict:
+        try:
+            return json.loads(self._metadata_path(key).read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def put(self, key: str, markdown: str, info: Optional[dict] = None) -> None:
+        if markdown.startswith(UNCACHEABLE_PREFIXES):
+            return
+        path = self._entry_path(key)
+        # Write then rename so concurrent readers never see a partial entry
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        stored = {field: info[field] for field in CACHED_INFO_FIELDS if field in (info or {})}
+        if stored:
+            metadata_path = self._metadata_path(key)
+            tmp_path = metadata_path.with_suffix(suffix)
+            tmp_path.write_text(json.dumps(stored), encoding="utf-8")
+            os.replace(tmp_path, metadata_path)
+        tmp_path = path.with_suffix(suffix)
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as file:
+            file.write(markdown)
+        os.replace(tmp_path, path)
+        self.evict()
+
+    def _entries(self) -> list:
+        entries = []
+        for path in self.root.glob("*.md"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """Drop least recently used entries until the cache fits in max_bytes"""
+        entries = sorted(self._entries())
+        total = sum(size for _mtime, size, _path in entries)
+        removed = 0
+        for _mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                path.unlink()
+                removed += 1
+            with contextlib.suppress(FileNotFoundError):
+                path.with_suffix(".json").unlink()
+            total -= size
+        if removed:
+            self._record("evictions", removed)
+        return removed
+
+    def _load_counters(self) -> dict:
+        try:
+            return json.loads(self.stats_path.read_text(encoding="utf-8"))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _record(self, counter: str, amount: int = 1) -> None:
+        with self._lock:
+            counters = self._load_counters()
+            counters[counter] = counters.get(counter, 0) + amount
+            tmp_path = self.stats_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp_path.write_text(json.dumps(counters), encoding="utf-8")
+            os.replace(tmp_path, self.stats_path)
+
+    def stats(self) -> dict:
+        counters = self._load_counters()
+        hits = counters.get("hits", 0)
+        misses = counters.get("misses", 0)
+        entries = self._entries()
+        return {
+            "dir": str(self.root),
+            "entries": len(entries),
+            "bytes": sum(size for _mtime, size, _path in entries),
+            "maxBytes": self.max_bytes,
+            "hits": hits,
+            "misses": misses,
+            "evictions": counters.get("evictions", 0),
+            "hitRate": round(hits / (hits + misses), 4) if hits + misses else 0.0,
+        }
+
+def cached_conversion_info(cache: ConversionCache, key: str, input_path: str, workers: int, route: str) -> dict:
+    """Route metadata for a cache hit, read from the entry instead of re-planning"""
+    stored = cache.metadata(key)
+    if stored.get("route"):
+        return stored
+    return {"route": resolve_converter(input_path, workers, route)[0]}
+
+def is_cacheable(input_path: str) -> bool:
+    # Plain text is already as cheap as a cache read
+    return Path(input_path).suffix.lower() not in ['.txt', '.md']
+
+def convert_with_cache_info(
+    input_path: str,
+    workers: int = 1,
+    cache: Optional[ConversionCache] = None,
+    route: str = DEFAULT_ROUTE,
+    info: Optional[dict] = None,
+) -> tuple:
+    """Return (markdown, cache_hit) for a conversion through the cache"""
+    if cache is None or not is_cacheable(input_path):
+        return convert_document(input_path, workers=workers, route=route, info=info), False
+
+    key = cache.key_for(input_path, workers, route)
+    markdown = cache.get(key)
+    info = {} if info is None else info
+    if markdown is not None:
+        info.update(cached_conversion_info(cache, key, input_path, workers, route))
+        return markdown, True
+    markdown = convert_document(input_path, workers=workers, route=route, info=info)
+    # A memory-guard fallback is not what this key promises; convert again next time
+    if not info.get("memoryGuard", {}).get("tripped"):
+        cache.put(key, markdown, info)
+    return markdown, False
+
+def convert_document_cached(
+    input_path: str,
+    workers: int = 1,
+    cache: Optional[ConversionCache] = None,
+    route: str = DEFAULT_ROUTE,
+    info: Optional[dict] = None,
+) -> str:
+    """convert_document() with a content-addressed cache lookup in front"""
+    return convert_with_cache_info(input_path, workers, cache, route, info)[0]
+
+
+def collect_batch_inputs(source: str) -> list:
+    """Resolve a directory, glob pattern or manifest file into input paths"""
+    path = Path(source)
+
+    if path.is_dir():
+        return sorted(
+            str(item) for item in path.rglob("*")
+            if item.is_file() and item.suffix.lower() in SUPPORTED_EXTENSIONS
+        )
+
+    if path.is_file() and path.suffix.lower() in ['.json', '.txt', '.lst']:
+        base = path.parent
+        if path.suffix.lower() == '.json':
+            manifest = json.loads(path.read_text(encoding="utf-8"))
+            entries = manifest.get("files", []) if isinstance(manifest, dict) else manifest
+        else:
+            entries = [
+                line.strip() for line in path.read_text(encoding="utf-8").splitlines()
+                if line.strip() and not line.strip().startswith("#")
+            ]
+        # Manifest entries are relative to the manifest's own directory
+        return [str(base / entry) if not os.path.isabs(entry) else entry for entry in entries]
+
+    return sorted(item for item in glob.glob(source, recursive=True) if os.path.isfile(item))
+
+def batch_output_path(input_path: str, base_dir: str, output_dir: str) -> Path:
+    try:
+        relative = Path(os.path.relpath(input_path, base_dir))
+    except ValueError:
+        relative = Path(Path(input_path).name)
+    if relative.parts and relative.parts[0] == '..':
+        relative = Path(Path(input_path).name)
+    return Path(output_dir) / relative.with_suffix('.md')
+
+def convert_batch_item(
+    input_path: str,
+    output_path: Path,
+    workers: int = 1,
+    cache=None,
+    route: str = DEFAULT_ROUTE,
+) -> dict:
+    """Convert one batch input and describe the outcome for the report"""
+    item = {
+        "input": input_path,
+        "output": None,
+        "status": "ok",
+        "pages": None,
+        "seconds": None,
+        "converter": None,
+        "cached": False,
+        "error": None,
+        "metadata": None,
+    }
+    started = time.perf_counter()
+    try:
+        if not os.path.exists(input_path):
+            raise FileNotFoundError(f"File not found: {input_path}")
+        if Path(input_path).suffix.lower() == '.pdf':
+            item["pages"] = count_pdf_pages(input_path)
+        info = {}
+        markdown, item["cached"] = convert_with_cache_info(input_path, workers, cache, route, info)
+        # PDF conversions and cache hits report their route; other formats resolve cheaply
+        item["converter"] = info.get("route") or resolve_converter(input_path, workers, route)[0]
+        item["metadata"] = info or None
+        if markdown.startswith(UNCACHEABLE_PREFIXES):
+            raise RuntimeError(markdown)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        output_path.write_text(markdown, encoding="utf-8")
+        item["output"] = str(output_path)
+    except Exception as e:
+        item["status"] = "error"
+        item["error"] = str(e)
+    item["seconds"] = round(time.perf_counter() - started, 3)
+    return item
+
+def run_batch(
+    source: str,
+    output_dir: str,
+    jobs: int = 2,
+    workers: int = 1,
+    cache=None,
+    report_path=None,
+    route: str = DEFAULT_ROUTE,
+) -> dict:
+    """Convert every input of a batch and write a JSON report next to the outputs"""
+    from concurrent.futures import ThreadPoolExecutor
+
+    output_root = os.path.abspath(output_dir)
+    # Skip outputs of an earlier run when the output dir sits inside the source
+    inputs = [
+        item for item in collect_batch_inputs(source)
+        if os.path.commonpath([os.path.abspath(item), output_root]) != output_root
+    ]
+    existing_dirs = [os.path.dirname(os.path.abspath(item)) for item in inputs if os.path.exists(item)]
+    base_dir = os.path.commonpath(existing_dirs) if existing_dirs else os.getcwd()
+    started = time.perf_counter()
+
+    # Threads share the loaded models; marker runs serialize on MARKER_LOCK
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        files = list(pool.map(
+            lambda item: convert_batch_item(
+                item,
+                batch_output_path(os.path.abspath(item), base_dir, output_dir),
+                workers,
+                cache,
+                route,
+            ),
+            inputs,
+        ))
+
+    succeeded = sum(1 for item in files if item["status"] == "ok")
+    report = {
+        "source": source,
+        "outputDir": str(output_dir),
+        "jobs": jobs,
+        "files": files,
+        "summary": {
+            "total": len(files),
+            "succeeded": succeeded,
+            "failed": len(files) - succeeded,
+            "cached": sum(1 for item in files if item["cached"]),
+            "pages": sum(item["pages"] or 0 for item in files),
+            "seconds": round(time.perf_counter() - started, 3),
+        },
+    }
+
+    report_file = Path(report_path) if report_path else Path(output_dir) / "report.json"
+    report_file.parent.mkdir(parents=True, exist_ok=True)
+    report_file.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+    return report
+
+
+class ConverterServer:
+    """Long-lived converter that keeps marker models warm between requests"""
+
+    def __init__(self, cache: Optional[ConversionCache] = None):
+        self.cache = cache
+        self.started_at = time.time()
+        self.models_loaded = False
+        self.marker_available = None
+        self.served = 0
+        self.failed = 0
+        self.stopping = False
+        # marker models are not thread-safe; conversions run one at a time
+        self._convert_lock = threading.Lock()
+
+    def warm_up(self) -> None:
+        """Import marker and load its models before the first request"""
+        try:
+            load_marker_models()
+            self.models_loaded = True
+            self.marker_available = True
+        except ImportError:
+            self.marker_available = False
+
+    def health(self) -> dict:
+        return {
+            "status": "stopping" if self.stopping else "ready",
+            "pid": os.getpid(),
+            "uptimeSeconds": round(time.time() - self.started_at, 3),
+            "modelsLoaded": self.models_loaded,
+            "markerAvailable": self.marker_available,
+            "busy": self._convert_lock.locked(),
+            "served": self.served,
+            "failed": self.failed,
+            "cache": self.cache.stats() if self.cache else None,
+        }
+
+    def convert(
+        self,
+        input_path: str,
+        workers: int = 1,
+        use_cache: bool = True,
+        route: str = DEFAULT_ROUTE,
+        emit=None,
+    ) -> dict:
+        """Convert one file; with ``emit``, page frames go to it and the end frame is returned"""
+        if not input_path or not os.path.exists(input_path):
+            raise FileNotFoundError(f"File not found: {input_path}")
+
+        with self._convert_lock:
+            started = time.perf_counter()
+            cache = self.cache if use_cache else None
+            if emit is not None:
+                frames = {}
+
+                def collect(frame: dict) -> None:
+                    if frame["type"] == "end":
+                        frames["end"] = frame
+                    else:
+                        emit(frame)
+
+                with contextlib.redirect_stdout(sys.stderr):
+                    stream_document(input_path, workers=workers, cache=cache, route=route, emit=collect)
+                self.models_loaded = load_marker_models.cache_info().currsize > 0
+                return frames["end"]
+
+            # Libraries print progress to stdout; keep it off the protocol stream
+            with contextlib.redirect_stdout(sys.stderr):
+                info = {}
+                markdown = convert_document_cached(
+                    input_path,
+                    workers=workers,
+                    cache=cache,
+                    route=route,
+                    info=info,
+                )
+            self.models_loaded = load_marker_models.cache_info().currsize > 0
+            return {
+                "markdown": markdown,
+                "seconds": round(time.perf_counter() - started, 3),
+                "metadata": info or None,
+            }
+
+    def handle(self, request: dict, emit=None) -> dict:
+        """Dispatch a single protocol request and build its response
+
+        ``emit`` writes a message to the client; streaming converts use it
+        for their page frames before the response is returned.
+        """
+        request_id = request.get("id")
+        op = request.get("op", "convert")
+
+        try:
+            if op == "health":
+                payload = self.health()
+            elif op == "convert":
+                stream = request.get("stream") and emit is not None
+                payload = self.convert(
+                    request.get("path"),
+                    int(request.get("workers", 1)),
+                    bool(request.get("cache", True)),
+                    request.get("route", DEFAULT_ROUTE),
+                    emit=(lambda frame: emit({"id": request_id, **frame})) if stream else None,
+                )
+                self.served += 1
+            elif op == "shutdown":
+                self.stopping = True
+                payload = {"status": "stopping"}
+            else:
+                raise ValueError(f"Unknown op: {op}")
+        except Exception as e:
+            if op == "convert":
+                self.failed += 1
+            return {"id": request_id, "ok": False, "error": str(e)}
+
+        return {"id": request_id, "ok": True, **payload}
+
+    def handle_line(self, line: str, emit=None):
+        line = line.strip()
+        if not line:
+            return None
+        try:
+            request = json.loads(line)
+        except json.JSONDecodeError as e:
+            return {"id": None, "ok": False, "error": f"Invalid JSON: {e}"}
+        if not isinstance(request, dict):
+            return {"id": None, "ok": False, "error": "Request must be a JSON object"}
+        return self.handle(request, emit)
+
+
+def serve_stdio(server: ConverterServer) -> None:
+    """Serve JSON-lines requests on stdin/stdout"""
+    out = sys.stdout
+
+    def emit(message: dict) -> None:
+        out.write(json.dumps(message, ensure_ascii=False) + "\n")
+        out.flush()
+
+    emit({"event": "ready", **server.health()})
+    for line in sys.stdin:
+        response = server.handle_line(line, emit)
+        if response is not None:
+            emit(response)
+        if server.stopping:
+            break
+
+
+def serve_socket(server: ConverterServer, socket_path: str) -> None:
+    """Serve JSON-lines requests on a Unix domain socket"""
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def emit(self, message: dict) -> None:
+            self.wfile.write((json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.wfile.flush()
+
+        def handle(self):
+            for raw in self.rfile:
+                response = server.handle_line(raw.decode("utf-8"), self.emit)
+                if response is not None:
+                    self.emit(response)
+                if server.stopping:
+                    threading.Thread(target=unix_server.shutdown, daemon=True).start()
+                    break
+
+    class UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    unix_server = UnixServer(socket_path, Handler)
+    print(json.dumps({"event": "ready", "socket": socket_path, **server.health()}), flush=True)
+    try:
+        unix_server.serve_forever()
+    finally:
+        unix_server.server_close()
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Convert documents to Markdown")
+    parser.add_argument("input", nargs="?", help="Path to the input document")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Extract text-layer PDF pages in N parallel processes (0 = one per CPU core)",
+    )
+    parser.add_argument(
+        "--route",
+        choices=PDF_ROUTES,
+        default=DEFAULT_ROUTE,
+        help="PDF extractor: pre-scan per document (auto) or per page (auto-page), or force one",
+    )
+    parser.add_argument(
+        "--max-rss-mb",
+        type=int,
+        default=MAX_RSS_MB,
+        help="RSS ceiling; past it the rest of the PDF is extracted with pypdf (0 = off)",
+    )
+    parser.add_argument("--metadata", help="Write conversion metadata (route, timing) as JSON to this path")
+    parser.add_argument("--stream", action="store_true", help="Emit NDJSON page frames as soon as each page is converted")
+    parser.add_argument(
+        "--stream-window",
+        type=int,
+        default=DEFAULT_STREAM_WINDOW,
+        help="Pages per marker run in --stream mode",
+    )
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR, help="Directory for the conversion cache")
+    parser.add_argument("--cache-max-mb", type=int, default=DEFAULT_CACHE_MAX_MB, help="Conversion cache size limit in MB")
+    parser.add_argument("--no-cache", action="store_true", help="Always convert, bypassing the conversion cache")
+    parser.add_argument("--cache-stats", action="store_true", help="Print conversion cache statistics as JSON and exit")
+    parser.add_argument("--batch", metavar="SOURCE", help="Convert a directory, glob pattern or manifest (.json/.txt) of inputs")
+    parser.add_argument("--output-dir", default="converted", help="Output directory for --batch Markdown files and report.json")
+    parser.add_argument("--report", help="Write the --batch JSON report here instead of <output-dir>/report.json")
+    parser.add_argument("--jobs", type=int, default=2, help="Files converted concurrently in --batch mode")
+    parser.add_argument("--serve", action="store_true", help="Run as a long-lived JSON-lines converter server")
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of stdin/stdout (with --serve)")
+    parser.add_argument("--no-preload", action="store_true", help="Load marker models on first request instead of at startup")
+    return parser
+
+
+def main():
+    global MAX_RSS_MB
+
+    args = build_parser().parse_args()
+    MAX_RSS_MB = args.max_rss_mb
+    cache = None if args.no_cache else ConversionCache(args.cache_dir, args.cache_max_mb * 1024 * 1024)
+
+    if args.cache_stats:
+        print(json.dumps(ConversionCache(args.cache_dir, args.cache_max_mb * 1024 * 1024).stats()))
+        return
+
+    if args.batch:
+        with contextlib.redirect_stdout(sys.stderr):
+            report = run_batch(
+                args.batch,
+                args.output_dir,
+                jobs=args.jobs,
+                workers=args.workers,
+                cache=cache,
+                report_path=args.report,
+                route=args.route,
+            )
+        print(json.dumps(report["summary"]))
+        sys.exit(1 if report["summary"]["failed"] else 0)
+
+    if args.serve:
+        server = ConverterServer(cache)
+        if not args.no_preload:
+            with contextlib.redirect_stdout(sys.stderr):
+                server.warm_up()
+        if args.socket:
+            serve_socket(server, args.socket)
+        else:
+            serve_stdio(server)
+        return
+
+    if not args.input:
+        print("Usage: python document_converter.py <input_file>", file=sys.stderr)
+        sys.exit(1)
+
+    input_path = args.input
+
+    if not os.path.exists(input_path):
+        print(f"File not found: {input_path}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.stream:
+        out = sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                stream_document(
+                    input_path,
+                    out,
+                    workers=args.workers,
+                    window=max(1, args.stream_window),
+                    cache=cache,
+                    route=args.route,
+                )
+        except Exception as e:
+            out.write(json.dumps({"type": "error", "error": str(e)}) + "\n")
+            out.flush()
+            sys.exit(1)
+        return
+
+    info = {}
+    result = convert_document_cached(input_path, workers=args.workers, cache=cache, route=args.route, info=info)
+
+    if args.metadata:
+        Path(args.metadata).write_text(json.dumps(info, ensure_ascii=False, indent=2), encoding="utf-8")
+
     print(result)
 
 if __name__ == "__main__":
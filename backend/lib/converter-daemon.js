@@ -0,0 +1,183 @@
+/**
+ * Shared document_converter.py daemon (--serve JSON-lines protocol)
+ *
+ * One Python process per Node process keeps the interpreter, imports and
+ * marker models warm across conversions. Callers fall back to spawning the
+ * converter per file when the daemon is unavailable (ConverterDaemonUnavailable).
+ */
+
+import path from 'path';
+import readline from 'readline';
+import { spawn } from 'child_process';
+import { fileURLToPath } from 'url';
+
+const __dirname = path.dirname(fileURLToPath(import.meta.url));
+
+export const CONVERTER_SCRIPT = path.join(__dirname, '..', 'converters', 'document_converter.py');
+
+const CONVERTER_DAEMON_ENABLED = process.env.CONVERTER_DAEMON !== 'false';
+// marker model preload happens before "ready"
+const CONVERTER_DAEMON_START_TIMEOUT_MS = Number(process.env.CONVERTER_DAEMON_START_TIMEOUT_MS || 180000);
+// After a failed start, spawn per file for this long before trying again
+const CONVERTER_DAEMON_RETRY_MS = Number(process.env.CONVERTER_DAEMON_RETRY_MS || 60000);
+const STDERR_TAIL_CHARS = 4000;
+
+export class ConverterDaemonUnavailable extends Error {
+  constructor(message = 'Converter daemon unavailable') {
+    super(message);
+    this.name = 'ConverterDaemonUnavailable';
+    this.code = 'CONVERTER_DAEMON_UNAVAILABLE';
+  }
+}
+
+let daemon = null;
+let starting = null;
+let retryAfter = 0;
+let nextId = 1;
+
+function pythonBins() {
+  return [process.env.PYTHON_BIN, 'python3', 'python']
+    .filter((value, index, list) => value && list.indexOf(value) === index);
+}
+
+function launch(bin) {
+  return new Promise((resolve, reject) => {
+    const child = spawn(bin, [CONVERTER_SCRIPT, '--serve'], {
+      stdio: ['pipe', 'pipe', 'pipe'],
+      env: { ...process.env, PYTHONIOENCODING: 'utf-8' },
+    });
+    const state = { child, pending: new Map(), stderr: '', closed: false };
+    let ready = false;
+
+    const timer = setTimeout(() => {
+      child.kill();
+      reject(new Error(`no ready event within ${CONVERTER_DAEMON_START_TIMEOUT_MS}ms`));
+    }, CONVERTER_DAEMON_START_TIMEOUT_MS);
+
+    // Always drain stderr: marker logs there and a full pipe would stall the daemon
+    child.stderr.setEncoding('utf8');
+    child.stderr.on('data', (data) => {
+      state.stderr = (state.stderr + data).slice(-STDERR_TAIL_CHARS);
+    });
+
+    readline.createInterface({ input: child.stdout }).on('line', (line) => {
+      let message;
+      try {
+        message = JSON.parse(line);
+      } catch {
+        return;
+      }
+      if (message.event === 'ready') {
+        ready = true;
+        clearTimeout(timer);
+        resolve(state);
+        return;
+      }
+      const request = state.pending.get(message.id);
+      if (!request) return;
+      // Stream frames carry a type but no ok flag; the final response has ok
+      if (message.ok === undefined) {
+        if (message.type === 'page' && request.onPage) request.onPage(message);
+        return;
+      }
+      state.pending.delete(message.id);
+      if (message.ok) {
+        request.resolve(message);
+      } else {
+        request.reject(new Error(message.error || 'Python conversion failed'));
+      }
+    });
+
+    child.stdin.on('error', () => null);
+    child.on('error', (error) => {
+      clearTimeout(timer);
+      reject(error);
+    });
+    child.on('close', (code) => {
+      clearTimeout(timer);
+      state.closed = true;
+      if (daemon === state) daemon = null;
+      const reason = state.stderr.trim().split('\n').pop() || `exit: ${code}`;
+      if (!ready) {
+        reject(new Error(reason));
+      }
+      for (const request of state.pending.values()) {
+        request.reject(new ConverterDaemonUnavailable(`Converter daemon exited (${reason})`));
+      }
+      state.pending.clear();
+    });
+  });
+}
+
+async function startDaemon() {
+  const failures = [];
+  for (const bin of pythonBins()) {
+    try {
+      return await launch(bin);
+    } catch (error) {
+      failures.push(`${bin}: ${error.message}`);
+    }
+  }
+  throw new ConverterDaemonUnavailable(failures.join(' | ') || 'Converter daemon failed to start');
+}
+
+async function getDaemon() {
+  if (daemon && !daemon.closed) return daemon;
+  if (!CONVERTER_DAEMON_ENABLED) {
+    throw new ConverterDaemonUnavailable('Converter daemon disabled (CONVERTER_DAEMON=false)');
+  }
+  if (Date.now() < retryAfter) {
+    throw new ConverterDaemonUnavailable('Converter daemon failed to start recently');
+  }
+  if (!starting) {
+    starting = startDaemon()
+      .then((state) => {
+        daemon = state;
+        return state;
+      })
+      .catch((error) => {
+        retryAfter = Date.now() + CONVERTER_DAEMON_RETRY_MS;
+        throw error;
+      })
+      .finally(() => {
+        starting = null;
+      });
+  }
+  return starting;
+}
+
+/**
+ * Convert a file through the daemon. With onPage, page frames are passed on
+ * as they arrive and the pages are joined into the result. Throws
+ * ConverterDaemonUnavailable when the daemon cannot serve the request, and a
+ * plain Error when the conversion itself failed.
+ */
+export async function convertWithDaemon(inputPath, onPage = null) {
+  const state = await getDaemon();
+  const id = String(nextId++);
+  const pages = [];
+
+  const response = await new Promise((resolve, reject) => {
+    state.pending.set(id, {
+      resolve,
+      reject,
+      onPage: onPage
+        ? (frame) => {
+          pages.push(frame.markdown || '');
+          onPage(frame);
+        }
+        : null,
+    });
+    state.child.stdin.write(
+      `${JSON.stringify({ id, op: 'convert', path: path.resolve(inputPath), stream: Boolean(onPage) })}\n`
+    );
+  });
+
+  return onPage ? pages.join('\n\n') : response.markdown;
+}
+
+export function stopConverterDaemon() {
+  if (!daemon || daemon.closed) return;
+  daemon.child.stdin.end(`${JSON.stringify({ id: 'shutdown', op: 'shutdown' })}\n`);
+  daemon = null;
+}
@@ -5,6 +5,7 @@
 import fs from 'fs/promises';
 import { spawn } from 'child_process';
 import { logEvent } from './logger.js';
+import { CONVERTER_SCRIPT, convertWithDaemon, ConverterDaemonUnavailable } from './converter-daemon.js';
 
 export function sendError(res, status, code, message, details, requestId) {
   return res.status(status).json({
@@ -50,6 +51,15 @@ export async function safeRemoveDir(targetPath) {
 }
 
 export async function runPythonConversion(pythonScript, inputPath) {
+  if (pythonScript === CONVERTER_SCRIPT) {
+    try {
+      return await convertWithDaemon(inputPath);
+    } catch (error) {
+      if (!(error instanceof ConverterDaemonUnavailable)) throw error;
+      logEvent('warn', { event: 'converter_daemon_unavailable', message: error.message });
+    }
+  }
+
   const pythonBins = [process.env.PYTHON_BIN, 'python3', 'python']
     .filter((value, index, list) => value && list.indexOf(value) === index);
   const failures = [];
@@ -43,6 +43,11 @@ import {
   getLatestPressPackForTemplateVersion,
 } from './stores/press-pack-store.js';
 import { evaluatePreflight } from './preflight.js';
+import {
+  convertWithDaemon,
+  ConverterDaemonUnavailable,
+  stopConverterDaemon,
+} from './lib/converter-daemon.js';
 import { usageStoreEnabled, createUsageEvent } from './stores/usage-store.js';
 
 const __filename = fileURLToPath(import.meta.url);
@@ -67,6 +72,10 @@ const JOB_STAGE_PROGRESS = {
   complete: 100,
 };
 
+// Page-progress events: at most one per step of progress or per interval
+const PAGE_PROGRESS_STEP = 5;
+const PAGE_PROGRESS_INTERVAL_MS = 2000;
+
 const DEFAULT_TEMPLATE_PREVIEW_MARKDOWN = `# Carbon Template Preview
 
 ## Executive Summary
@@ -270,7 +279,32 @@ async function reportStage(job, stage, message, progress = null, options = {}) {
   });
 }
 
-async function runPythonConversion(pythonScript, inputPath) {
+// Throttles page-level progress and writes it one event at a time, so a long
+// document cannot flood the job store; flush() waits for queued writes so
+// none lands after the completion event.
+function createProgressReporter(job, stage) {
+  let queue = Promise.resolve();
+  let lastProgress = null;
+  let lastReportedAt = 0;
+  return {
+    report(message, progress) {
+      const now = Date.now();
+      if (lastProgress !== null) {
+        const delta = progress - lastProgress;
+        if (delta <= 0) return;
+        if (delta < PAGE_PROGRESS_STEP && now - lastReportedAt < PAGE_PROGRESS_INTERVAL_MS) return;
+      }
+      lastProgress = progress;
+      lastReportedAt = now;
+      queue = queue.then(() => reportStage(job, stage, message, progress)).catch(() => null);
+    },
+    flush() {
+      return queue;
+    },
+  };
+}
+
+async function runPythonConversion(pythonScript, inputPath, onPage = null) {
   const pythonBins = [process.env.PYTHON_BIN, 'python3', 'python']
     .filter((value, index, list) => value && list.indexOf(value) === index);
   const failures = [];
@@ -278,13 +312,35 @@ async function runPythonConversion(pythonScript, inputPath) {
   for (const bin of pythonBins) {
     try {
       return await new Promise((resolve, reject) => {
-        const pythonProcess = spawn(bin, [pythonScript, inputPath]);
+        const pythonProcess = spawn(bin, [pythonScript, inputPath, '--stream']);
 
-        let output = '';
+        const pages = [];
+        let pending = '';
         let errorOutput = '';
 
+        // NDJSON frames: start, page..., end (or error)
+        const handleLine = (line) => {
+          if (!line.trim()) return;
+          let frame;
+          try {
+            frame = JSON.parse(line);
+          } catch {
+            return;
+          }
+          if (frame.type === 'page') {
+            pages.push(frame.markdown || '');
+            if (onPage) onPage(frame);
+          } else if (frame.type === 'error') {
+            errorOutput += frame.error || '';
+          }
+        };
+
+        pythonProcess.stdout.setEncoding('utf8');
         pythonProcess.stdout.on('data', (data) => {
-          output += data.toString();
+          pending += data;
+          const lines = pending.split('\n');
+          pending = lines.pop();
+          lines.forEach(handleLine);
         });
 
         pythonProcess.stderr.on('data', (data) => {
@@ -296,8 +352,9 @@ async function runPythonConversion(pythonScript, inputPath) {
         });
 
         pythonProcess.on('close', (code) => {
+          handleLine(pending);
           if (code === 0) {
-            resolve(output);
+            resolve(pages.join('\n\n'));
           } else {
             reject(new Error(errorOutput || `Python conversion failed (exit: ${code})`));
           }
@@ -311,9 +368,15 @@ async function runPythonConversion(pythonScript, inputPath) {
   throw new Error(failures.join(' | ') || 'Python conversion failed');
 }
 
-async function convertWithPython(inputPath) {
+async function convertWithPython(inputPath, onPage = null) {
+  try {
+    return await convertWithDaemon(inputPath, onPage);
+  } catch (error) {
+    if (!(error instanceof ConverterDaemonUnavailable)) throw error;
+    console.warn(`[worker] converter daemon unavailable, spawning per file: ${error.message}`);
+  }
   const pythonScript = path.join(__dirname, 'converters', 'document_converter.py');
-  return runPythonConversion(pythonScript, inputPath);
+  return runPythonConversion(pythonScript, inputPath, onPage);
 }
 
 async function handleConvertMarkdown(job) {
@@ -432,7 +495,20 @@ async function handleConvertMarkdown(job) {
       fileName: fileName || mdFile,
     };
   } catch (error) {
-    const fallback = await convertWithPython(filePath);
+    const pageProgress = createProgressReporter(job, 'parse');
+    let fallback;
+    try {
+      fallback = await convertWithPython(filePath, (frame) => {
+        if (!frame.pageCount) return;
+        const done = Math.min(frame.pageCount, frame.page + (frame.pages || 1) - 1);
+        pageProgress.report(
+          `Converted page ${done}/${frame.pageCount}`,
+          25 + (done / frame.pageCount) * 65
+        );
+      });
+    } finally {
+      await pageProgress.flush();
+    }
     await reportStage(job, 'complete', 'Markdown ready', 100, { status: 'completed' });
     if (usageStoreEnabled) {
       await createUsageEvent({
@@ -1028,6 +1104,7 @@ async function gracefulShutdown(signal) {
     process.exit(1);
   }, 30000);
   await worker.close();
+  stopConverterDaemon();
   await jobQueue.close();
   await connection.quit();
   clearTimeout(timeout);
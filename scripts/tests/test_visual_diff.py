@@ -0,0 +1,65 @@
+"""Checks for scripts/vendor/visual_diff.py (run with pytest or directly)"""
+import sys
+from pathlib import Path
+
+from PIL import Image, ImageDraw
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "vendor"))
+
+import visual_diff  # noqa: E402
+
+WIDTH, HEIGHT = 60, 20
+EDGE_X = 10  # anti-aliased column between a black and a white area
+LINE_X = 40  # 1 px content line
+
+
+def render(edge_gray, line_x):
+    image = Image.new("RGB", (WIDTH, HEIGHT), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((0, 0, EDGE_X - 1, HEIGHT - 1), fill="black")
+    draw.line((EDGE_X, 0, EDGE_X, HEIGHT - 1), fill=(edge_gray,) * 3)
+    draw.line((line_x, 0, line_x, HEIGHT - 1), fill="black")
+    return image
+
+
+def test_counts_every_changed_pixel():
+    result, _ = visual_diff.diff_images(render(96, LINE_X), render(160, LINE_X + 1), 0.01)
+    assert result["mismatchPixels"] == 3 * HEIGHT
+
+
+def test_identical_images_match():
+    result, _ = visual_diff.diff_images(render(96, LINE_X), render(96, LINE_X), 0.01, ignore_antialiasing=True)
+    assert result["mismatchPixels"] == 0
+    assert result["ignoredAntialiasPixels"] == 0
+
+
+def test_ignores_pure_antialiasing_change():
+    result, _ = visual_diff.diff_images(render(96, LINE_X), render(160, LINE_X), 0.01, ignore_antialiasing=True)
+    assert result["mismatchPixels"] == 0
+    assert result["ignoredAntialiasPixels"] == HEIGHT
+
+
+def test_keeps_content_shift_next_to_antialiasing_change():
+    result, diff = visual_diff.diff_images(
+        render(96, LINE_X), render(160, LINE_X + 1), 0.01, ignore_antialiasing=True
+    )
+    # The edge column is anti-aliasing; both columns of the moved line are real
+    assert result["ignoredAntialiasPixels"] == HEIGHT
+    assert result["mismatchPixels"] == 2 * HEIGHT
+    assert diff.convert("L").getbbox() == (LINE_X, 0, LINE_X + 2, HEIGHT)
+
+
+def test_keeps_new_glyph():
+    baseline = render(96, LINE_X)
+    current = baseline.copy()
+    ImageDraw.Draw(current).rectangle((25, 5, 29, 9), fill="black")
+    result, _ = visual_diff.diff_images(baseline, current, 0.01, ignore_antialiasing=True)
+    assert result["mismatchPixels"] == 25
+    assert result["ignoredAntialiasPixels"] == 0
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"ok {name}")
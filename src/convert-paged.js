@@ -2300,6 +2300,10 @@ async function runVisualRegression(options = {}) {
       diffPath,
       '--threshold',
       String(threshold),
+      '--index',
+      path.join(baselineDir, 'index.json'),
+      '--key',
+      baselineKey,
     ]);
     const payload = stdout ? JSON.parse(stdout.trim()) : {};
     if (payload.sizeMismatch) {
@@ -2314,7 +2318,8 @@ async function runVisualRegression(options = {}) {
     return {
       baselinePath,
       currentPath: screenshotPath,
-      diffPath,
+      diffPath: payload.skipped ? null : diffPath,
+      skipped: payload.skipped === true,
       mismatchPixels: payload.mismatchPixels || 0,
       mismatchRatio,
       threshold,
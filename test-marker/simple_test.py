@@ -36,11 +36,8 @@ def main():
 
     print("Converting PDF...")
 
-    # Convert the PDF
-    with open(pdf_path, 'rb') as f:
-        pdf_bytes = f.read()
-
-    rendered = converter(pdf_bytes)
+    # Convert the PDF (marker opens the file itself; no whole-file read)
+    rendered = converter(str(pdf_path))
 
     # Save markdown output
     output_file = output_dir / "test-document.md"
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Converter server protocol and cache tests (run with pytest or directly)
+"""
+
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+CONVERTER = Path(__file__).resolve().parents[1] / "backend" / "converters" / "document_converter.py"
+sys.path.insert(0, str(CONVERTER.parent))
+
+import document_converter as dc  # noqa: E402
+
+
+def write_pdf(path, pages):
+    """Minimal text-only PDF, one Helvetica line per page"""
+    count = len(pages)
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{4 + 2 * i} 0 R" for i in range(count)), count),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for index, text in enumerate(pages):
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * index} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    data = b"%PDF-1.4\n"
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(data))
+        data += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(data)
+    data += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    data += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    data += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode("latin-1")
+    Path(path).write_bytes(data)
+    return str(path)
+
+
+def sample_pdf(directory):
+    return write_pdf(Path(directory) / "sample.pdf", ["First page", "Second page", "Third page"])
+
+
+def test_health_and_protocol_errors():
+    server = dc.ConverterServer()
+
+    health = server.handle({"id": "1", "op": "health"})
+    assert health["ok"] and health["id"] == "1"
+    assert health["status"] == "ready" and health["busy"] is False
+
+    assert server.handle_line("   ") is None
+    assert server.handle_line("{not json")["error"].startswith("Invalid JSON")
+    assert server.handle_line("[]")["error"] == "Request must be a JSON object"
+    assert server.handle({"id": "2", "op": "bogus"}) == {"id": "2", "ok": False, "error": "Unknown op: bogus"}
+
+    missing = server.handle({"id": "3", "op": "convert", "path": "/nonexistent/input.pdf"})
+    assert missing["ok"] is False and "File not found" in missing["error"]
+    assert (server.served, server.failed) == (0, 1)
+
+    assert server.handle({"id": "4", "op": "shutdown"})["status"] == "stopping"
+    assert server.stopping
+
+
+def test_convert_returns_markdown():
+    with tempfile.TemporaryDirectory() as tmp:
+        server = dc.ConverterServer()
+        response = server.handle({"id": "1", "op": "convert", "path": sample_pdf(tmp), "route": "pypdf"})
+
+    assert response["ok"], response
+    assert "Second page" in response["markdown"]
+    assert response["metadata"]["route"] == "pypdf"
+    assert server.served == 1
+
+
+def test_streamed_convert_tags_frames_with_request_id():
+    frames = []
+    with tempfile.TemporaryDirectory() as tmp:
+        server = dc.ConverterServer()
+        response = server.handle(
+            {"id": "7", "op": "convert", "path": sample_pdf(tmp), "route": "pypdf", "stream": True},
+            frames.append,
+        )
+
+    assert [frame["type"] for frame in frames] == ["start", "page", "page", "page"]
+    assert all(frame["id"] == "7" for frame in frames)
+    assert "Third page" in frames[-1]["markdown"]
+    # The end frame comes back as the response, not as a frame
+    assert response["ok"] and response["type"] == "end"
+    assert (response["pages"], response["pageCount"], response["cached"]) == (3, 3, False)
+
+
+def test_stream_without_emit_falls_back_to_plain_response():
+    with tempfile.TemporaryDirectory() as tmp:
+        response = dc.ConverterServer().handle(
+            {"id": "1", "op": "convert", "path": sample_pdf(tmp), "route": "pypdf", "stream": True}
+        )
+    assert response["ok"] and "First page" in response["markdown"]
+
+
+def test_cache_miss_then_hit_keeps_route_and_page_count():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = dc.ConversionCache(Path(tmp) / "cache")
+        pdf = sample_pdf(tmp)
+
+        info = {}
+        markdown, hit = dc.convert_with_cache_info(pdf, cache=cache, route="pypdf", info=info)
+        assert not hit and "First page" in markdown
+
+        key = cache.key_for(pdf, route="pypdf")
+        stored = cache.metadata(key)
+        assert stored["route"] == "pypdf"
+        assert stored["pageCount"] == 3
+
+        info = {}
+        cached, hit = dc.convert_with_cache_info(pdf, cache=cache, route="pypdf", info=info)
+        assert hit and cached == markdown
+        assert info["route"] == "pypdf"
+
+        stats = cache.stats()
+        assert (stats["hits"], stats["misses"]) == (1, 1)
+
+        # Another requested route is another key
+        assert cache.key_for(pdf, route="pdfplumber") != key
+
+
+def test_streamed_cache_hit_reports_page_count():
+    with tempfile.TemporaryDirectory() as tmp:
+        server = dc.ConverterServer(dc.ConversionCache(Path(tmp) / "cache"))
+        request = {"id": "1", "op": "convert", "path": sample_pdf(tmp), "route": "pypdf", "stream": True}
+
+        first = server.handle(request, lambda frame: None)
+        frames = []
+        second = server.handle(request, frames.append)
+
+    assert first["cached"] is False
+    assert second["cached"] is True
+    assert (second["pages"], second["pageCount"]) == (3, 3)
+    pages = [frame for frame in frames if frame["type"] == "page"]
+    assert len(pages) == 1 and pages[0]["pages"] == 3 and pages[0]["pageCount"] == 3
+
+
+def test_uncacheable_inputs_skip_the_cache():
+    with tempfile.TemporaryDirectory() as tmp:
+        cache = dc.ConversionCache(Path(tmp) / "cache")
+        text = Path(tmp) / "notes.txt"
+        text.write_text("plain notes", encoding="utf-8")
+
+        markdown, hit = dc.convert_with_cache_info(str(text), cache=cache)
+        assert markdown == "plain notes" and not hit
+        assert not list((Path(tmp) / "cache").glob("*.md"))
+
+
+def test_serve_stdio_protocol():
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf = sample_pdf(tmp)
+        requests = [
+            {"id": "1", "op": "health"},
+            {"id": "2", "op": "convert", "path": pdf, "route": "pypdf", "stream": True},
+            {"id": "3", "op": "shutdown"},
+        ]
+        process = subprocess.run(
+            # No model preload or shared cache: the protocol is what is under test
+            [sys.executable, str(CONVERTER), "--serve", "--no-preload", "--no-cache"],
+            input="".join(json.dumps(request) + "\n" for request in requests),
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            timeout=120,
+        )
+
+    messages = [json.loads(line) for line in process.stdout.splitlines()]
+    assert process.returncode == 0, process.stderr
+    assert messages[0]["event"] == "ready"
+    assert messages[1]["id"] == "1" and messages[1]["ok"]
+    converted = [message for message in messages if message.get("id") == "2"]
+    # Frames carry no ok flag; only the final response does
+    assert [message.get("type") for message in converted] == ["start", "page", "page", "page", "end"]
+    assert "ok" not in converted[0] and converted[-1]["ok"]
+    assert messages[-1] == {"id": "3", "ok": True, "status": "stopping"}
+
+
+if __name__ == "__main__":
+    for name, check in list(globals().items()):
+        if name.startswith("test_"):
+            check()
+            print(f"ok {name}")